@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+import ctypes
+import mmap
+import os
+import struct
+import sys
+
+import numpy as np
+from PIL import Image
+
+
+# Sprites and levels packed into one file, ready to use as they are
+#
+#   ./asset_bundle.py build assets.bundle     pack sprites/ and levels/
+#   ./asset_bundle.py list assets.bundle
+#
+# Images are stored as raw RGBA, bottom row first, and levels as one
+# byte per tile. The file is mmap'd, so nothing is decoded or even
+# read until it's used, and every game on the machine using the same
+# bundle shares the same pages of memory.
+#
+# Once a bundle is mounted, the usual loaders look in it first:
+# load_sprite() in shaded_sprite, SpriteAtlas.add_file() and
+# TileMap.load(). Entries are found by the path they were built
+# from, like "sprites/banana.png". If that file has changed since,
+# the entry is ignored and the file is loaded as before.
+#
+# File layout, little-endian:
+#   header:  "UWAB", u16 version, u16 0, u32 entries
+#   index:   per entry
+#              u16 name length, name,
+#              u8 kind, u32 width, u32 height, u16 tile size,
+#              u64 offset, u64 length,
+#              u64 source size, u64 source mtime (ns)
+#   data:    each entry at its offset, 16-byte aligned
+
+MAGIC = b"UWAB"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHHI")
+NAME = struct.Struct("<H")
+ENTRY = struct.Struct("<BIIHQQQQ")
+
+KIND_IMAGE = 0
+KIND_TILES = 1
+
+ALIGN = 16
+
+
+def _key(path):
+  return os.path.normpath(path)
+
+
+# Writes a bundle. images maps names to PIL images, tilemaps maps
+# names to TileMaps. If a name is a file path, the file's size and
+# modification time are stored, so a later edit is noticed.
+def write_bundle(path, images=None, tilemaps=None):
+  if images is None: images = {}
+  if tilemaps is None: tilemaps = {}
+
+  entries = []
+  for name,image in images.items():
+    if image.mode != 'RGBA':
+      image = image.convert('RGBA')
+    w,h = image.size
+    entries += [ (name, KIND_IMAGE, w, h, 0, image.tobytes('raw', 'RGBA', 0, -1)) ]
+
+  for name,tilemap in tilemaps.items():
+    entries += [ (name, KIND_TILES, tilemap.width, tilemap.height, tilemap.tile_size,
+                  tilemap.solid.astype(np.uint8).tobytes()) ]
+
+  index_size = HEADER.size
+  for name,_,_,_,_,_ in entries:
+    index_size += NAME.size + len(_key(name).encode("utf-8")) + ENTRY.size
+
+  index = bytearray(HEADER.pack(MAGIC, VERSION, 0, len(entries)))
+  offset = index_size
+  placed = []
+  for name,kind,w,h,tile_size,data in entries:
+    offset += -offset % ALIGN
+    src_size,src_mtime = 0, 0
+    if os.path.exists(name):
+      st = os.stat(name)
+      src_size,src_mtime = st.st_size, st.st_mtime_ns
+
+    encoded = _key(name).encode("utf-8")
+    index += NAME.pack(len(encoded)) + encoded
+    index += ENTRY.pack(kind, w, h, tile_size, offset, len(data), src_size, src_mtime)
+    placed += [ (offset, data) ]
+    offset += len(data)
+
+  # Write and rename, so a running game never maps half a file
+  tmp = "{}.{}.tmp".format(path, os.getpid())
+  with open(tmp, "wb") as f:
+    f.write(index)
+    for offset,data in placed:
+      f.write(b"\0" * (offset - f.tell()))
+      f.write(data)
+  os.replace(tmp, path)
+
+
+class AssetBundle:
+  def __init__(self, path):
+    self.path = path
+
+    with open(path, "rb") as f:
+      # Copy-on-write, so ctypes and numpy can point straight into it.
+      # Nothing writes to it, so the pages stay shared.
+      self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    magic,version,_,count = HEADER.unpack_from(self.mm)
+    if magic != MAGIC:
+      raise ValueError("{} is not an asset bundle".format(path))
+    if version != VERSION:
+      raise ValueError("{}: unsupported bundle version {}".format(path, version))
+
+    # name -> (kind, width, height, tile size, offset, length, source size, source mtime)
+    self.entries = {}
+    pos = HEADER.size
+    for _ in range(count):
+      length, = NAME.unpack_from(self.mm, pos)
+      pos += NAME.size
+      name = self.mm[pos:pos+length].decode("utf-8")
+      pos += length
+      self.entries[name] = ENTRY.unpack_from(self.mm, pos)
+      pos += ENTRY.size
+
+  def __contains__(self, name):
+    return _key(name) in self.entries
+
+  def names(self):
+    return list(self.entries)
+
+  # The entry for name if it's of the right kind and still matches
+  # the file it was made from
+  def _entry(self, name, kind):
+    entry = self.entries.get(_key(name))
+    if entry is None or entry[0] != kind: return None
+
+    src_size,src_mtime = entry[6], entry[7]
+    if src_size or src_mtime:
+      try:
+        st = os.stat(name)
+        if st.st_size != src_size or st.st_mtime_ns != src_mtime: return None
+      except OSError:
+        # Shipped without the sources, that's fine
+        pass
+    return entry
+
+  def _view(self, entry):
+    offset,length = entry[4], entry[5]
+    return memoryview(self.mm)[offset:offset+length]
+
+  # A PIL image sharing the mapped pixels, or None.
+  # Read only, like anything from load_sprite().
+  def image(self, name):
+    entry = self._entry(name, KIND_IMAGE)
+    if entry is None: return None
+    _,w,h,_,_,_,_,_ = entry
+    return Image.frombuffer('RGBA', (w, h), self._view(entry), 'raw', 'RGBA', 0, -1)
+
+  # A pyglet image uploading straight from the mapping, or None.
+  # pyglet is imported here, so levels load headless without it.
+  def image_data(self, name):
+    import pyglet
+
+    entry = self._entry(name, KIND_IMAGE)
+    if entry is None: return None
+    _,w,h,_,offset,length,_,_ = entry
+    pixels = (ctypes.c_ubyte * length).from_buffer(self.mm, offset)
+    return pyglet.image.ImageData(w, h, 'RGBA', pixels, pitch=4*w)
+
+  # (tiles, tile size) with tiles a (height, width) uint8 array on
+  # the mapping, bottom row first, or None
+  def tiles(self, name):
+    entry = self._entry(name, KIND_TILES)
+    if entry is None: return None
+    _,w,h,tile_size,offset,_,_,_ = entry
+    tiles = np.frombuffer(self.mm, dtype=np.uint8, count=w*h, offset=offset)
+    return tiles.reshape(h, w), tile_size
+
+
+# Bundles the loaders look in, newest first
+MOUNTED = []
+
+def mount(path, missing_ok=False):
+  if missing_ok and not os.path.exists(path): return None
+  bundle = AssetBundle(path)
+  MOUNTED.insert(0, bundle)
+  return bundle
+
+def unmount_all():
+  del MOUNTED[:]
+
+def find_image(name):
+  for bundle in MOUNTED:
+    image = bundle.image(name)
+    if image is not None: return image
+  return None
+
+def find_image_data(name):
+  for bundle in MOUNTED:
+    image = bundle.image_data(name)
+    if image is not None: return image
+  return None
+
+def find_tiles(name):
+  for bundle in MOUNTED:
+    tiles = bundle.tiles(name)
+    if tiles is not None: return tiles
+  return None
+
+
+# Everything in sprites/ and levels/
+def build(path, sprite_dir="sprites", level_dir="levels"):
+  # Imported here, tilemap itself looks for levels in bundles
+  from tilemap import TileMap
+
+  images = {}
+  for name in sorted(os.listdir(sprite_dir)):
+    if not name.endswith(".png"): continue
+    image = Image.open(os.path.join(sprite_dir, name))
+
+    # Masks in other modes mean something else once made RGBA,
+    # those are left to load from their files
+    if image.mode != 'RGBA':
+      sys.stderr.write("Not bundling {}, it's {} and not RGBA\n".format(name, image.mode))
+      continue
+
+    image.load()
+    images[os.path.join(sprite_dir, name)] = image
+
+  tilemaps = {}
+  if os.path.isdir(level_dir):
+    for name in sorted(os.listdir(level_dir)):
+      level = os.path.join(level_dir, name)
+      if os.path.isfile(level):
+        tilemaps[level] = TileMap.load(level)
+
+  write_bundle(path, images, tilemaps)
+
+
+def main():
+  if len(sys.argv) != 3 or sys.argv[1] not in [ "build", "list" ]:
+    print("Usage: {} build|list BUNDLE".format(sys.argv[0]))
+    sys.exit(1)
+
+  if sys.argv[1] == "build":
+    build(sys.argv[2])
+
+  bundle = AssetBundle(sys.argv[2])
+  kinds = [ "image", "tiles" ]
+  for name,entry in bundle.entries.items():
+    kind,w,h,_,_,length,_,_ = entry
+    print("{:40} {:6} {:5}x{:<5} {:8} bytes".format(name, kinds[kind], w, h, length))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,173 @@
+import numpy as np
+
+
+# Batched narrow-phase for Entity.collide
+#
+# Boxes are given as arrays instead of Entity objects. The rules are
+# the same as Entity.collide(), evaluated for every mover/static pair
+# at once.
+
+
+# A fixed set of boxes, typically the static world
+class BoxArray:
+  def __init__(self, x, y, width, height, vx=None, vy=None):
+    self.x = np.asarray(x, dtype=np.float64)
+    self.y = np.asarray(y, dtype=np.float64)
+    self.width = np.asarray(width, dtype=np.float64)
+    self.height = np.asarray(height, dtype=np.float64)
+
+    n = len(self.x)
+    self.vx = np.zeros(n) if vx is None else np.asarray(vx, dtype=np.float64)
+    self.vy = np.zeros(n) if vy is None else np.asarray(vy, dtype=np.float64)
+
+    # Set when a mover runs into them, like Entity.bump_*
+    self.bump_up    = np.zeros(n, dtype=np.bool_)
+    self.bump_down  = np.zeros(n, dtype=np.bool_)
+    self.bump_left  = np.zeros(n, dtype=np.bool_)
+    self.bump_right = np.zeros(n, dtype=np.bool_)
+
+  def __len__(self):
+    return len(self.x)
+
+  @staticmethod
+  def from_entities(entities):
+    return BoxArray([ e.x for e in entities ],
+                    [ e.y for e in entities ],
+                    [ e.width for e in entities ],
+                    [ e.height for e in entities ],
+                    [ e.vx for e in entities ],
+                    [ e.vy for e in entities ])
+
+  # Copy the bumps back to the entities the array was built from
+  def store_bumps(self, entities):
+    for i,e in enumerate(entities):
+      if self.bump_up[i]: e.bump_up = True
+      if self.bump_down[i]: e.bump_down = True
+      if self.bump_left[i]: e.bump_left = True
+      if self.bump_right[i]: e.bump_right = True
+
+
+# Every mover (rows) against every static box (columns).
+# All mover arguments are (N,) arrays, all static ones (M,) arrays.
+#
+# Returns (up, down, left, right, snap_x, snap_y), each of shape (N,M).
+# up/down/left/right are the bumps collide() would set on the mover,
+# snap_x/snap_y the position collide(ent, snap=True) would leave it at.
+def collide_pairs(x, y, w, h, vx, vy, sx, sy, sw, sh, svx, svy):
+  x = x[:, None]
+  y = y[:, None]
+  right = x + w[:, None]
+  top = y + h[:, None]
+  vx = vx[:, None]
+  vy = vy[:, None]
+
+  s_right = sx + sw
+  s_top = sy + sh
+
+  overlap_v = ((sy <= y) & (y <= s_top)) | ((y <= sy) & (sy <= top))
+  overlap_h = ((sx <= x) & (x <= s_right)) | ((x <= sx) & (sx <= right))
+
+  # Up or down bump
+  hit_top = (sy <= top) & (top <= s_top)
+  hit_bottom = (sy <= y) & (y <= s_top)
+  move_top = (vy > 0) | (svy < 0)
+
+  up = overlap_h & move_top & hit_top & ~hit_bottom
+  down = overlap_h & hit_bottom & ~hit_top
+  vertical = up | down
+
+  # Left or right bump, only if there was no vertical one
+  hit_left = (sx <= x) & (x <= s_right)
+  hit_right = (sx <= right) & (right <= s_right)
+  move_right = (vx > 0) | (svx < 0)
+  move_left = (vx < 0) | (svx > 0)
+
+  side = overlap_v & ~vertical
+  left = side & move_left & hit_left & ~hit_right
+  right_ = side & move_right & hit_right & ~hit_left
+
+  snap_y = np.where(up, sy - h[:, None], np.where(down, s_top, y))
+  snap_x = np.where(left, s_right, np.where(right_, sx - w[:, None], x))
+
+  return up, down, left, right_, snap_x, snap_y
+
+
+# Same as running
+#   for ent in statics: mover.collide(ent, snap)
+# for every mover.
+#
+# movers is anything with x, y, width, height, vx, vy and bump_* arrays
+# (an EntityArray, a BoxArray). Only the first n of them are used.
+# Positions are snapped and bumps set in place, on both sides.
+# Returns a mask of the movers that collided with anything.
+#
+# Each round handles the first collision of every mover that's still
+# going, then continues from the next static box. Movers only need as
+# many rounds as they have collisions, so this stays a few array
+# operations per frame.
+def resolve(movers, statics, snap=False, n=None):
+  if n is None: n = len(movers.x)
+  hit_any = np.zeros(n, dtype=np.bool_)
+  if n == 0 or len(statics) == 0: return hit_any
+
+  m = len(statics)
+  columns = np.arange(m)
+
+  active = np.arange(n)
+  start = np.zeros(n, dtype=np.int64)
+
+  while active.size > 0:
+    up, down, left, right, snap_x, snap_y = collide_pairs(
+        movers.x[active], movers.y[active],
+        movers.width[active], movers.height[active],
+        movers.vx[active], movers.vy[active],
+        statics.x, statics.y, statics.width, statics.height,
+        statics.vx, statics.vy)
+
+    hit = up | down | left | right
+
+    if not snap:
+      # Nothing moves, so every pair is independent
+      movers.bump_up[active] |= up.any(axis=1)
+      movers.bump_down[active] |= down.any(axis=1)
+      movers.bump_left[active] |= left.any(axis=1)
+      movers.bump_right[active] |= right.any(axis=1)
+      statics.bump_down[up.any(axis=0)] = True
+      statics.bump_up[down.any(axis=0)] = True
+      statics.bump_right[left.any(axis=0)] = True
+      statics.bump_left[right.any(axis=0)] = True
+      hit_any[active] = hit.any(axis=1)
+      break
+
+    # Ignore the boxes already visited by each mover
+    hit &= columns[None, :] >= start[active][:, None]
+
+    rows = np.flatnonzero(hit.any(axis=1))
+    if rows.size == 0: break
+
+    cols = np.argmax(hit[rows], axis=1)
+    idx = active[rows]
+
+    movers.x[idx] = snap_x[rows, cols]
+    movers.y[idx] = snap_y[rows, cols]
+
+    u = up[rows, cols]
+    d = down[rows, cols]
+    l = left[rows, cols]
+    r = right[rows, cols]
+
+    movers.bump_up[idx[u]] = True
+    movers.bump_down[idx[d]] = True
+    movers.bump_left[idx[l]] = True
+    movers.bump_right[idx[r]] = True
+
+    statics.bump_down[cols[u]] = True
+    statics.bump_up[cols[d]] = True
+    statics.bump_right[cols[l]] = True
+    statics.bump_left[cols[r]] = True
+
+    hit_any[idx] = True
+    start[idx] = cols + 1
+    active = idx
+
+  return hit_any
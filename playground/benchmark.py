@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+import pyglet
+
+# Nothing here draws. Without a shadow window, the modules that use
+# pyglet.gl can be imported on machines with no display.
+pyglet.options["shadow_window"] = False
+
+from PIL import Image
+
+from physics import Entity, ColoredBlock
+from platforming import Player
+from spatial_hash import SpatialHash
+from headless import Hitbox
+from sleep import SleepSystem
+from shaded_sprite import shaded_sprite, shaded_palette
+from input_mapper import Joydev
+
+
+# Timing the hot parts of the games on their own
+#
+#   ./benchmark.py                       run everything, print results
+#   ./benchmark.py --out base.json       ... and save them
+#   ./benchmark.py --compare base.json   flag anything slower than
+#                                        the saved run
+#
+# Each benchmark is run at a few sizes. A result is the time per
+# operation (one collide() call, one Player.tick(), one decoded
+# event, ...) so different sizes can be compared with each other.
+# The median of several samples is what gets compared, the best
+# one is there for reference.
+#
+# --compare exits with status 1 if anything regressed by more than
+# --threshold, so it can be used from CI.
+
+FORMAT_VERSION = 1
+
+
+def _random_blocks(n, width, height, rng):
+  blocks = []
+  for i in range(n):
+    w = rng.randrange(16, 128)
+    h = rng.randrange(16, 64)
+    blocks += [ ColoredBlock(rng.uniform(0, width), rng.uniform(0, height), w, h,
+                             None, "block{}".format(i)) ]
+  return blocks
+
+def _random_players(n, width, height, rng):
+  players = []
+  for i in range(n):
+    p = Player(Hitbox(32, 32))
+    p.x = rng.uniform(0, width)
+    p.y = rng.uniform(0, height)
+    p.vx = rng.uniform(-6, 6)
+    p.vy = rng.uniform(-10, 12)
+    p.move(rng.uniform(-1, 1))
+    players += [ p ]
+  return players
+
+# Boxes bouncing around, like the coxes in test_bouncy
+def _bodies(n, width, height, rng):
+  bodies = []
+  for i in range(n):
+    b = Entity(rng.uniform(32, width-64), rng.uniform(32, height-64), 32, 32, "body{}".format(i))
+    b.vx = rng.uniform(-8, 8)
+    b.vy = rng.uniform(-8, 8)
+    bodies += [ b ]
+  return bodies
+
+def _clear_bumps(ent):
+  ent.bump_up = False
+  ent.bump_down = False
+  ent.bump_left = False
+  ent.bump_right = False
+
+
+#
+# Each benchmark takes its parameters and returns (run, ops), where
+# run() does the work once and ops is how many operations that is.
+#
+
+# Every player against every block, without snapping
+def bench_collide(blocks, players):
+  rng = random.Random(1)
+  world = _random_blocks(blocks, 2048, 2048, rng)
+  actors = _random_players(players, 2048, 2048, rng)
+
+  def run():
+    for actor in actors:
+      for ent in world:
+        actor.collide(ent)
+
+  return run, blocks * players
+
+# Same, through the spatial hash with snapping. One op per player.
+def bench_collide_hash(blocks, players):
+  rng = random.Random(1)
+  world = _random_blocks(blocks, 2048, 2048, rng)
+  actors = _random_players(players, 2048, 2048, rng)
+  start = [ (a.x, a.y) for a in actors ]
+
+  world_hash = SpatialHash()
+  for ent in world:
+    world_hash.insert(ent)
+
+  def run():
+    for actor,(x, y) in zip(actors, start):
+      actor.x = x
+      actor.y = y
+      _clear_bumps(actor)
+      world_hash.collide(actor, True)
+
+  return run, players
+
+def bench_player_tick(players):
+  rng = random.Random(1)
+  actors = _random_players(players, 640, 480, rng)
+
+  def run():
+    for actor in actors:
+      actor.tick(1/60)
+
+  return run, players
+
+# A whole simulation step: players and bouncing bodies moving and
+# colliding with the level. One op per moving thing.
+def bench_world(blocks, players, bodies):
+  rng = random.Random(1)
+  width = height = 2048
+
+  world = _random_blocks(blocks, width, height, rng)
+  world += [ ColoredBlock(-32, -32, width+64, 40, None, "Floor"),
+             ColoredBlock(-32, -32, 40, height+64, None, "LeftWall"),
+             ColoredBlock(width-8, -32, 48, height+64, None, "RightWall"),
+             ColoredBlock(-32, height-8, width+64, 40, None, "Ceiling") ]
+
+  world_hash = SpatialHash()
+  for ent in world:
+    world_hash.insert(ent)
+
+  actors = _random_players(players, width, height, rng)
+  movers = _bodies(bodies, width, height, rng)
+
+  def run():
+    for actor in actors:
+      actor.tick(1/60)
+      _clear_bumps(actor)
+      world_hash.collide(actor, True)
+
+    for body in movers:
+      body.x += body.vx
+      body.y += body.vy
+      _clear_bumps(body)
+      world_hash.collide(body, True)
+      if body.bump_left or body.bump_right: body.vx *= -1
+      if body.bump_up or body.bump_down: body.vy *= -1
+
+  return run, players + bodies
+
+# Lots of players standing around, a few moving. With the
+# SleepSystem, only the moving ones cost anything. One op per player.
+# At a spacing of 32 the players stand right next to each other.
+def bench_sleeping(players, moving, spacing=64):
+  rng = random.Random(1)
+  floor = ColoredBlock(-32, -32, spacing * players + 64, 40, None, "Floor")
+  world_hash = SpatialHash()
+  world_hash.insert(floor)
+
+  sleep = SleepSystem()
+  actors = []
+  for i in range(players):
+    p = Player(Hitbox(32, 32))
+    p.x = spacing * i
+    p.y = floor.top
+    if i < moving:
+      p.move(rng.choice([ -1, 1 ]))
+    actors += [ p ]
+    sleep.add(p)
+
+  def run():
+    for actor in sleep.active():
+      actor.tick(1/60)
+      _clear_bumps(actor)
+      world_hash.collide(actor, True)
+    sleep.settle()
+
+    # Keep the moving ones moving
+    for actor in actors[:moving]:
+      if actor.bump_left or actor.bump_right or actor.x < 0 or actor.x > spacing * players:
+        actor.move(-actor.vx_target / actor.vx_max)
+
+  # Let the idle ones fall asleep before timing
+  for _ in range(sleep.ticks_to_sleep + 2):
+    run()
+
+  return run, players
+
+# Fast bodies moving with SpatialHash.sweep(). One op per body.
+def bench_sweep(blocks, bodies):
+  rng = random.Random(1)
+  world = _random_blocks(blocks, 2048, 2048, rng)
+  movers = _bodies(bodies, 2048, 2048, rng)
+  start = [ (b.x, b.y) for b in movers ]
+
+  world_hash = SpatialHash()
+  for ent in world:
+    world_hash.insert(ent)
+
+  def run():
+    for body,(x, y) in zip(movers, start):
+      body.x = x
+      body.y = y
+      world_hash.sweep(body, body.vx * 20, body.vy * 20)
+
+  return run, bodies
+
+def _cox_images():
+  fg = Image.open("sprites/player_fg_normal.png").convert("RGBA")
+  mask = Image.open("sprites/player_bg_normal.png")
+  fg.load()
+  mask.load()
+  return fg, mask
+
+# One shaded sprite per op
+def bench_shaded_sprite(colors):
+  fg,mask = _cox_images()
+  rng = random.Random(1)
+  palette = [ (rng.randrange(256), rng.randrange(256), rng.randrange(256), 255)
+              for _ in range(colors) ]
+
+  def run():
+    for color in palette:
+      shaded_sprite(fg, mask, color)
+
+  return run, colors
+
+def bench_shaded_palette(colors):
+  fg,mask = _cox_images()
+  rng = random.Random(1)
+  palette = [ (rng.randrange(256), rng.randrange(256), rng.randrange(256), 255)
+              for _ in range(colors) ]
+
+  def run():
+    shaded_palette(fg, mask, palette)
+
+  return run, colors
+
+# Joystick events through a pipe, decoded by Joydev.get_event().
+# One op per raw event. The write into the pipe is timed too, but
+# it's a single system call.
+def bench_joydev(events):
+  rng = random.Random(1)
+
+  joy = Joydev("/dev/null")
+  r,w = os.pipe()
+  os.set_blocking(r, False)
+  joy.fd = r
+  for i in range(8):
+    joy.axis_map[i] = "ax{}".format(i)
+    joy.axis_state[i] = 0.0
+    joy.axis_discrete[i] = 0
+  for i in range(13):
+    joy.button_map[i] = "b{}".format(i)
+    joy.button_state[i] = 0
+
+  raw = bytearray()
+  for i in range(events):
+    if rng.random() < 0.2:
+      raw += Joydev.JS_EVENT.pack(i, rng.randrange(2), 0x01, rng.randrange(13))
+    else:
+      raw += Joydev.JS_EVENT.pack(i, rng.randrange(-32767, 32768), 0x02, rng.randrange(8))
+  raw = bytes(raw)
+
+  def run():
+    os.write(w, raw)
+    joy.get_event()
+
+  return run, events
+
+
+# name -> (function, list of parameter sets)
+BENCHMARKS = {
+  "collide":        (bench_collide,       [ dict(blocks=64, players=1), dict(blocks=1024, players=8) ]),
+  "collide_hash":   (bench_collide_hash,  [ dict(blocks=64, players=1), dict(blocks=1024, players=8) ]),
+  "player_tick":    (bench_player_tick,   [ dict(players=1), dict(players=64) ]),
+  "world":          (bench_world,         [ dict(blocks=64, players=2, bodies=40),
+                                            dict(blocks=1024, players=8, bodies=200) ]),
+  "sleeping":       (bench_sleeping,      [ dict(players=256, moving=4),
+                                            dict(players=256, moving=4, spacing=32) ]),
+  "sweep":          (bench_sweep,         [ dict(blocks=64, bodies=40), dict(blocks=1024, bodies=200) ]),
+  "shaded_sprite":  (bench_shaded_sprite, [ dict(colors=1), dict(colors=16) ]),
+  "shaded_palette": (bench_shaded_palette, [ dict(colors=16) ]),
+  # Stays below the 64k a pipe holds
+  "joydev":         (bench_joydev,        [ dict(events=64), dict(events=4096) ]),
+}
+
+
+def _key(name, params):
+  return "{}[{}]".format(name, ",".join("{}={}".format(k, v) for k,v in params.items()))
+
+# Runs run() in batches long enough to time, returns a list of
+# seconds per op
+def _measure(run, ops, samples, min_time):
+  # Warm up, so one-off costs like caches filling aren't timed
+  run()
+
+  # Find how many runs make a sample. These runs are thrown away too.
+  loops = 1
+  while True:
+    start = time.perf_counter()
+    for _ in range(loops):
+      run()
+    elapsed = time.perf_counter() - start
+    if elapsed >= min_time: break
+    loops *= 2
+
+  times = []
+  for _ in range(samples):
+    start = time.perf_counter()
+    for _ in range(loops):
+      run()
+    times += [ (time.perf_counter() - start) / (loops * ops) ]
+  return times
+
+def run_benchmarks(only=None, samples=5, min_time=0.05):
+  results = {}
+  for name,(function,param_sets) in BENCHMARKS.items():
+    if only and name not in only: continue
+
+    for params in param_sets:
+      run,ops = function(**params)
+      times = _measure(run, ops, samples, min_time)
+      key = _key(name, params)
+      results[key] = {
+        "benchmark": name,
+        "params": params,
+        "ops": ops,
+        "median": statistics.median(times),
+        "best": min(times),
+      }
+      print("{:50} {:>12}/op".format(key, _format_time(results[key]["median"])))
+      sys.stdout.flush()
+
+  return {
+    "version": FORMAT_VERSION,
+    "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    "python": platform.python_version(),
+    "machine": platform.machine(),
+    "platform": platform.platform(),
+    "results": results,
+  }
+
+def _format_time(seconds):
+  if seconds < 1e-6: return "{:.1f} ns".format(seconds * 1e9)
+  if seconds < 1e-3: return "{:.2f} us".format(seconds * 1e6)
+  return "{:.2f} ms".format(seconds * 1e3)
+
+# Returns a list of (key, baseline, current, ratio, regressed)
+def compare(baseline, current, threshold):
+  rows = []
+  for key,result in current["results"].items():
+    if key not in baseline["results"]: continue
+    base = baseline["results"][key]["median"]
+    now = result["median"]
+    ratio = now / base
+    rows += [ (key, base, now, ratio, ratio > 1 + threshold) ]
+  return rows
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark the simulation and input code")
+  parser.add_argument("--out", help="write the results to this JSON file")
+  parser.add_argument("--compare", metavar="BASELINE", help="compare against results saved with --out")
+  parser.add_argument("--threshold", type=float, default=0.10,
+                      help="how much slower counts as a regression (default 0.10 = 10%%)")
+  parser.add_argument("--only", action="append", choices=list(BENCHMARKS),
+                      help="run just this benchmark, can be repeated")
+  parser.add_argument("--samples", type=int, default=5)
+  parser.add_argument("--min-time", type=float, default=0.05,
+                      help="seconds each sample runs for at least")
+  args = parser.parse_args()
+
+  baseline = None
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)
+    if baseline.get("version") != FORMAT_VERSION:
+      sys.stderr.write("{} is from a different benchmark version\n".format(args.compare))
+      sys.exit(2)
+
+  current = run_benchmarks(args.only, args.samples, args.min_time)
+
+  if args.out:
+    with open(args.out, "w") as f:
+      json.dump(current, f, indent=2)
+      f.write("\n")
+
+  if baseline is None: return
+
+  print()
+  print("Compared to {}:".format(args.compare))
+  regressed = False
+  for key,base,now,ratio,bad in compare(baseline, current, args.threshold):
+    mark = "REGRESSION" if bad else ""
+    print("{:50} {:>12} -> {:>12}  {:+6.1f}%  {}".format(
+          key, _format_time(base), _format_time(now), (ratio - 1) * 100, mark))
+    regressed = regressed or bad
+
+  if regressed:
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
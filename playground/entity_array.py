@@ -0,0 +1,170 @@
+import numpy as np
+
+from batch_collide import resolve
+
+
+# Struct-of-arrays storage for many Players
+#
+# Each field of Entity/Player lives in its own contiguous array,
+# indexed by the slot number returned from add(). tick() applies
+# the same rules as Player.tick() to every slot at once.
+#
+# Use load()/store() to copy state between the arrays and the
+# Player objects (for drawing, or for code that still works on
+# single entities).
+class EntityArray:
+
+  # Per-entity instantaneous state
+  STATE_FLOAT = [ "x", "y", "vx", "vy", "width", "height", "vx_target" ]
+  STATE_INT   = [ "jump_strength" ]
+  STATE_BOOL  = [ "bump_up", "bump_down", "bump_left", "bump_right", "jumping" ]
+
+  # Per-entity tuning, see Player.__init__
+  TUNING_FLOAT = [ "ay", "vy_max_fall", "ax_move", "ax_stop",
+                   "ax_move_air", "ax_stop_air", "vx_max", "vy_jump" ]
+  TUNING_INT   = [ "jump_strength_max" ]
+
+  def __init__(self, capacity=64):
+    self.count = 0
+    self.capacity = 0
+    self._allocate(max(capacity, 1))
+
+  def __len__(self):
+    return self.count
+
+  def _fields(self):
+    for name in self.STATE_FLOAT + self.TUNING_FLOAT:
+      yield name, np.float64
+    for name in self.STATE_INT + self.TUNING_INT:
+      yield name, np.int64
+    for name in self.STATE_BOOL:
+      yield name, np.bool_
+
+  def _allocate(self, capacity):
+    for name,dtype in self._fields():
+      arr = np.zeros(capacity, dtype=dtype)
+      if self.capacity > 0:
+        arr[:self.count] = getattr(self, name)[:self.count]
+      setattr(self, name, arr)
+    self.capacity = capacity
+
+  # Returns the slot of the new entity
+  def add(self, player):
+    if self.count == self.capacity:
+      self._allocate(self.capacity * 2)
+
+    i = self.count
+    self.count += 1
+    self.load(player, i)
+    return i
+
+  # Copy everything from a Player into slot i
+  def load(self, player, i):
+    for name,_ in self._fields():
+      getattr(self, name)[i] = getattr(player, name)
+
+  # Copy the instantaneous state of slot i back into a Player
+  def store(self, player, i):
+    for name in self.STATE_FLOAT:
+      setattr(player, name, float(getattr(self, name)[i]))
+    for name in self.STATE_INT:
+      setattr(player, name, int(getattr(self, name)[i]))
+    for name in self.STATE_BOOL:
+      setattr(player, name, bool(getattr(self, name)[i]))
+
+  def store_all(self, players):
+    for i,player in enumerate(players):
+      self.store(player, i)
+
+  def clear_bumps(self):
+    n = self.count
+    self.bump_up[:n] = False
+    self.bump_down[:n] = False
+    self.bump_left[:n] = False
+    self.bump_right[:n] = False
+
+
+  # Same as Player.move()
+  def move(self, i, value):
+    self.vx_target[i] = value * self.vx_max[i]
+
+  # Same as Player.jump()
+  def jump(self, i, active):
+    if (self.jumping[i]):
+      if (not active):
+        self.jumping[i] = False
+      return
+
+    if (self.bump_down[i]):
+      if (active):
+        self.jumping[i] = True
+        self.jump_strength[i] = self.jump_strength_max[i]
+
+
+  def _jump(self, n):
+    jump_strength = self.jump_strength[:n]
+    jumping = self.jumping[:n]
+    vy = self.vy[:n]
+
+    # Bumped your head
+    jump_strength[self.bump_up[:n]] = 0
+
+    # Held long enough for a maximum jump
+    jumping &= (jump_strength != 0)
+
+    jump_strength -= jumping
+    np.copyto(vy, self.vy_jump[:n], where=jumping)
+
+  def _move(self, n):
+    vx = self.vx[:n]
+    bump_down = self.bump_down[:n]
+
+    dv = self.vx_target[:n] - vx
+
+    dir_x = np.copysign(1.0, vx)
+    dir_dv = np.copysign(1.0, dv)
+
+    is_decrease = (vx != 0) & (dir_dv != dir_x)
+
+    ax = np.where(is_decrease,
+                  np.where(bump_down, self.ax_stop[:n], self.ax_stop_air[:n]),
+                  np.where(bump_down, self.ax_move[:n], self.ax_move_air[:n]))
+
+    # Clamp to prevent overshoot
+    ax = dir_dv * np.minimum(ax, np.abs(dv))
+
+    vx += ax
+    vx_max = self.vx_max[:n]
+    np.maximum(vx, -vx_max, out=vx)
+    np.minimum(vx, vx_max, out=vx)
+
+  def _bump(self, n):
+    vx = self.vx[:n]
+    vy = self.vy[:n]
+    vy[(self.bump_up[:n] & (vy > 0)) | (self.bump_down[:n] & (vy < 0))] = 0
+    vx[(self.bump_left[:n] & (vx < 0)) | (self.bump_right[:n] & (vx > 0))] = 0
+
+  # One Player.tick() for every entity
+  def tick(self, dt):
+    n = self.count
+    if n == 0: return
+
+    # Gravity
+    vy = self.vy[:n]
+    falling = ~self.bump_down[:n]
+    fall = np.maximum(vy + self.ay[:n], self.vy_max_fall[:n])
+    np.copyto(vy, fall, where=falling)
+
+    self._jump(n)
+    self._move(n)
+    self._bump(n)
+
+    self.x[:n] += self.vx[:n]
+    self.y[:n] += vy
+
+  # Same as clearing the bumps and running
+  #   for ent in world: player.collide(ent, True)
+  # for every player, with the world given as a BoxArray
+  def collide_world(self, statics):
+    self.clear_bumps()
+    return resolve(self, statics, True, self.count)
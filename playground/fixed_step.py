@@ -0,0 +1,69 @@
+
+# Fixed-timestep driver for the simulation
+#
+# Call frame(dt) once per rendered frame with the real elapsed time.
+# It runs step(self.dt) as many times as needed to catch up, so the
+# game runs at the same speed no matter how fast the display is.
+#
+# At most max_steps are run per frame. If the machine can't keep up
+# at all, the remaining backlog is dropped (the game slows down)
+# instead of piling up more and more steps every frame.
+#
+# Tracked entities remember where they were before the last step,
+# and position() blends between that and the current position for
+# smooth drawing between steps.
+class FixedStepLoop:
+  def __init__(self, step, rate=60, max_steps=5):
+    self.step = step
+    self.dt = 1.0 / rate
+    self.max_steps = max_steps
+
+    self.accumulator = 0.0
+
+    # How far between the previous and current step we're drawing
+    self.alpha = 0.0
+
+    self.ticks = 0
+    self.dropped = 0
+
+    # entity -> (x, y) before the last step
+    self.previous = {}
+
+  def track(self, ent):
+    self.previous[ent] = (ent.x, ent.y)
+
+  def untrack(self, ent):
+    self.previous.pop(ent, None)
+
+  def _save_positions(self):
+    for ent in self.previous:
+      self.previous[ent] = (ent.x, ent.y)
+
+  # Returns the number of steps taken
+  def frame(self, dt):
+    self.accumulator += dt
+
+    steps = 0
+    while self.accumulator >= self.dt:
+      if steps == self.max_steps:
+        # Spiral of death, give up on the backlog
+        self.dropped += int(self.accumulator / self.dt)
+        self.accumulator %= self.dt
+        break
+
+      self._save_positions()
+      self.step(self.dt)
+      self.accumulator -= self.dt
+      self.ticks += 1
+      steps += 1
+
+    self.alpha = self.accumulator / self.dt
+    return steps
+
+  # Where to draw an entity right now
+  def position(self, ent):
+    if ent not in self.previous: return ent.x, ent.y
+    px,py = self.previous[ent]
+    a = self.alpha
+    return (px + (ent.x - px) * a,
+            py + (ent.y - py) * a)
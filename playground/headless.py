@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+
+from platforming import Player, PlayerController
+from spatial_hash import SpatialHash
+from replay import InputReplayer
+from sleep import SleepSystem
+from tilemap import TileMap
+
+
+# Running the game simulation with no window, no GL and no input
+# devices, as fast as the CPU allows.
+#
+#   sim = Simulation(TileMap.load(PLAYGROUND))
+#   sim.players[0].move(1)
+#   sim.run(600)
+#
+# Input can come from a replay (see replay.py), or from a script
+# calling sim.controller.on_input(), or the Player methods directly,
+# between steps. Nothing here imports pyglet, so it works on servers
+# and CI machines without a display.
+
+
+# The level test_platforming plays in
+PLAYGROUND = "levels/playground.json"
+
+
+# Stands in for a sprite, the simulation only needs the size
+class Hitbox:
+  def __init__(self, width, height):
+    self.width = width
+    self.height = height
+
+  def draw(self, window, x, y):
+    pass
+
+
+class Simulation:
+  # world is a list of static entities, or a TileMap.
+  # The player starts at (x, y), same as in test_platforming.
+  # With swept set, players move with SpatialHash.sweep() and can't
+  # pass through thin blocks however fast they go.
+  def __init__(self, world, x=32, y=300, rate=60, swept=False):
+    self.dt = 1.0 / rate
+    self.swept = swept
+    self.ticks = 0
+
+    self.world = world
+    if isinstance(world, TileMap):
+      # Already indexed by its tiles
+      self.world_hash = world
+    else:
+      self.world_hash = SpatialHash()
+      for ent in world:
+        self.world_hash.insert(ent)
+
+    player = Player(Hitbox(32, 32))
+    player.x = x
+    player.y = y
+    self.players = [ player ]
+
+    # Players standing still aren't ticked at all
+    self.sleep = SleepSystem()
+    for p in self.players:
+      self.sleep.add(p)
+
+    # Quitting from the console just stops run()
+    self.quit = False
+    self.controller = PlayerController(player, on_quit=self._on_quit)
+
+    self.replayer = None
+
+  def _on_quit(self):
+    self.quit = True
+
+  # Take the input from a recording instead
+  def replay(self, path):
+    self.replayer = InputReplayer(self.controller, path)
+
+  def step(self):
+    if self.replayer is not None:
+      self.replayer.advance()
+
+    for player in self.sleep.active():
+      if self.swept:
+        player.accelerate(self.dt)
+        self.world_hash.sweep(player, player.vx, player.vy)
+      else:
+        player.tick(self.dt)
+
+      player.bump_up = False
+      player.bump_down = False
+      player.bump_left = False
+      player.bump_right = False
+
+      self.world_hash.collide(player, True)
+
+    self.sleep.settle()
+    self.ticks += 1
+
+  # Run a number of ticks, or until a replay has run out if
+  # ticks is None. Returns the ticks per second achieved.
+  def run(self, ticks=None):
+    if ticks is None:
+      if self.replayer is None:
+        raise ValueError("Need a number of ticks, or a replay")
+      ticks = self.replayer.last_tick + 1 - self.replayer.tick
+
+    start = time.perf_counter()
+    done = 0
+    while done < ticks and not self.quit:
+      self.step()
+      done += 1
+    elapsed = time.perf_counter() - start
+
+    if elapsed == 0: return float("inf")
+    return done / elapsed
+
+
+def main():
+  args = sys.argv[1:]
+
+  level = None
+  if args[:1] == [ "--level" ] and len(args) > 1:
+    level = args[1]
+    args = args[2:]
+
+  if len(args) < 1:
+    print("Usage: {} [--level FILE] RECORDING [TICKS]".format(sys.argv[0]))
+    print("       {} [--level FILE] --ticks TICKS".format(sys.argv[0]))
+    sys.exit(1)
+
+  if level is None:
+    # Where test_platforming starts, so its recordings play the same
+    sim = Simulation(TileMap.load(PLAYGROUND))
+  else:
+    # Just inside the bottom left corner
+    world = TileMap.load(level)
+    sim = Simulation(world, x=world.tile_size, y=world.tile_size)
+
+  if args[0] == "--ticks":
+    rate = sim.run(int(args[1]))
+  else:
+    sim.replay(args[0])
+    ticks = None
+    if len(args) > 1: ticks = int(args[1])
+    rate = sim.run(ticks)
+
+  for player in sim.players:
+    print("{} at ({}, {}) moving ({}, {})".format(player.name, player.x, player.y, player.vx, player.vy))
+  print("{} ticks, {:.0f} ticks/s".format(sim.ticks, rate))
+
+
+if __name__ == "__main__":
+  main()
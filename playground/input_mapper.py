@@ -10,6 +10,13 @@
 # call start() again to open them again with the same configuration
 # call shutdown() to kill the background thread
 #
+# Devices that are missing or fail while running are left out, and
+# the others keep working. They're picked up again when they show
+# up in /dev/input.
+#
+# Or, from asyncio code, iterate over input_stream() instead of
+# using setup() and a handler.
+#
 # Analog controls get a value between -1.0 and 1.0
 # Buttons get 1 for "pressed" and 0 for "released"
 #
@@ -18,9 +25,20 @@
 # Buttons can be bound to ax0-, ax0+, ax1-, ...
 #
 # controller is one of "controller1", "controller2", "console"
+#
+# The handler may also provide
+#     handler.bind(controller, event)
+# returning a function taking just the value (or None to ignore the
+# event). It's called once per mapped control at setup(), and input
+# is then delivered straight to those functions.
+#
+# Handlers are called from the input thread. To get the events on
+# the game's thread instead, wrap the handler in an InputQueue.
 
 
 import os
+import asyncio
+import ctypes
 import struct
 import array
 import json
@@ -29,6 +47,7 @@ import select
 import evdev
 import threading
 import time
+import functools
 from fcntl import ioctl
 
 # This maps to a plugged-in Dual-shock 4 for player 1
@@ -93,19 +112,33 @@ DEFAULT_MAP = json.loads("""
 """)
 
 
+# Kinds of decoded joystick input
+JS_BUTTON = 0       # b0, b1, ...
+JS_AXIS = 1         # ax0, ax1, ...
+JS_AXIS_PLUS = 2    # ax0+, ...
+JS_AXIS_MINUS = 3   # ax0-, ...
+
+
 class Joydev:
+
+  # struct js_event, see linux/joystick.h
+  JS_EVENT = struct.Struct('IhBB')
+
+  # Events read per system call
+  READ_EVENTS = 64
+
   def __init__(self, device):
     self.device = device
     self.fd = None
 
-    if (not os.path.exists(self.device)):
-      raise RuntimeError("Unable to find joystick device {}".format(self.device))
+    # Reused for every read
+    self.evbuf = bytearray(self.JS_EVENT.size * self.READ_EVENTS)
 
     # Maps from event number to axis/button name
     self.axis_map = {}
     self.button_map = {}
 
-    # Last known state
+    # Last known state, by event number
     self.axis_state = {}
     self.axis_discrete = {}
     self.button_state = {}
@@ -135,8 +168,8 @@ class Joydev:
     for axis in buf[:num_axes]:
         axis_name = "ax{}".format(index)
         self.axis_map[index] = axis_name
-        self.axis_state[axis_name] = 0.0
-        self.axis_discrete[axis_name] = 0
+        self.axis_state[index] = 0.0
+        self.axis_discrete[index] = 0
         index += 1
 
     # Get the button map.
@@ -147,7 +180,7 @@ class Joydev:
     for btn in buf[:num_buttons]:
         btn_name = "b{}".format(index)
         self.button_map[index] = btn_name
-        self.button_state[btn_name] = 0
+        self.button_state[index] = 0
         index += 1
 
     #sys.stderr.write('%d axes found: %s\n' % (num_axes, ', '.join(self.axis_map.values())))
@@ -155,113 +188,180 @@ class Joydev:
 
   def start(self):
     if (self.fd is not None): return
-    self.fd = open(self.device, "rb")
-    self._configure()
+
+    if (not os.path.exists(self.device)):
+      raise RuntimeError("Unable to find joystick device {}".format(self.device))
+
+    # Non-blocking, so get_event() can read until the device is empty
+    self.fd = os.open(self.device, os.O_RDONLY | os.O_NONBLOCK)
+    try:
+      self._configure()
+    except OSError:
+      self.stop()
+      raise
+
+  # True if a device node with this name in /dev/input could be us
+  def watches(self, name):
+    return os.path.basename(self.device) == name
 
   def stop(self):
     if (self.fd is None): return
-    self.fd.close()
+    os.close(self.fd)
     self.fd = None
 
   def fileno(self):
-    return self.fd.fileno()
+    return self.fd
 
   # Waits for a bit, returns True if there's an event.
-  def wait(self):
-    ready,_,_ = select.select([self], [], [], 0.5)
+  def wait(self, timeout=0.5):
+    ready,_,_ = select.select([self], [], [], timeout)
     if len(ready) > 0: return True
     return False
 
-  # Do a select() on the joydev or use joydev.wait()
-  # then call this to read and parse one event
-  # returns None if the event was for initial state
-  # Returns a list of tuples of 
-  # returns "b0",1 for button presses
-  # returns "ax2",-0.4 for axis changes
-  def get_event(self):
-    evbuf = self.fd.read(8)
-    if evbuf:
-      time, value, type, number = struct.unpack('IhBB', evbuf)
+  # Read everything the device has queued up.
+  # Returns a list of (time, value, type, number) tuples
+  def _read_events(self):
+    events = []
+    view = memoryview(self.evbuf)
+    while True:
+      try:
+        n = os.readv(self.fd, [ self.evbuf ])
+      except BlockingIOError:
+        break
+
+      events += self.JS_EVENT.iter_unpack(view[:n - n % self.JS_EVENT.size])
+
+      # Didn't fill the buffer, so there's nothing more right now
+      if n < len(self.evbuf): break
+
+    return events
+
+  # Read and decode all pending events, without naming them.
+  # Returns a list of (kind, number, value), kind being one of JS_*
+  #
+  # Analog axes only report their latest value from each read,
+  # however many times they moved in between. Button presses, and
+  # the ax+/ax- presses of axes, are all reported in order.
+  def _decode(self):
+    ret = []
 
-      ret = []
+    # number -> latest value
+    latest_axes = {}
+
+    for time, value, type, number in self._read_events():
+      # Initial state events update the state, but aren't reported
+      init = type & 0x80
+      out = [] if init else ret
 
       if type & 0x01:
         # Button event
-        btn_name = self.button_map[number]
-        if btn_name:
-          self.button_state[btn_name] = value
+        if number in self.button_map:
+          self.button_state[number] = value
           if value:
-            ret += [(btn_name,1)]
+            out.append((JS_BUTTON, number, 1))
           else:
-            ret += [(btn_name,0)]
+            out.append((JS_BUTTON, number, 0))
 
       if type & 0x02:
         # Axis event
-        ax_name = self.axis_map[number]
-        if ax_name:
-
-          # Analog axis event
+        if number in self.axis_map:
           fvalue = value / 32767.0
-          ret += [(ax_name, fvalue)]
-          self.axis_state[ax_name] = fvalue
-
+          if init:
+            self.axis_state[number] = fvalue
+          else:
+            latest_axes[number] = fvalue
 
           # Discrete (ax+ and ax-) events
-          discrete = self.axis_discrete[ax_name]
+          previous = self.axis_discrete[number]
+          discrete = previous
           if (fvalue > 0.75): discrete = 1
           elif (fvalue < -0.75): discrete = -1
           elif (fvalue < 0.1 and fvalue > -0.1): discrete = 0
 
           # If the axis moved enough, make it either a button press or release
-          if (discrete != self.axis_discrete[ax_name]):
+          if (discrete != previous):
 
             if (discrete == 1):
-              ret += [ (ax_name+"+", 1) ]   # Pressed
+              out.append((JS_AXIS_PLUS, number, 1))     # Pressed
             elif (discrete == -1):
-              ret += [ (ax_name+"-", 1) ]   # Pressed
+              out.append((JS_AXIS_MINUS, number, 1))    # Pressed
             else:
-              if (self.axis_discrete[ax_name] == 1):
-                ret += [ (ax_name+"+", 0) ]   # Released
-
-              if (self.axis_discrete[ax_name] == -1):
-                ret += [ (ax_name+"-", 0) ]   # Released
+              if (previous == 1):
+                out.append((JS_AXIS_PLUS, number, 0))   # Released
 
-            self.axis_discrete[ax_name] = discrete
+              if (previous == -1):
+                out.append((JS_AXIS_MINUS, number, 0))  # Released
 
-      if type & 0x80:
-         ret = None
+            self.axis_discrete[number] = discrete
 
-      return ret
+    # Analog axis events
+    for number,fvalue in latest_axes.items():
+      self.axis_state[number] = fvalue
+      ret.append((JS_AXIS, number, fvalue))
 
+    return ret
 
-class Keyboard:
-
-  def __init__(self):
-    self.device = None
-    self.evdev = None
-
-    # Go through available devices and pick the first that seems
-    # to be a keyboard
-    devices = [evdev.InputDevice(path) for path in evdev.list_devices()]
-    self.device = None
-    for device in devices:
-      caps = device.capabilities(verbose=True)
-      K1 = ('EV_KEY', 1)
-      if K1 not in caps: continue
-
-      keymap = caps[K1]
-      for keycode, number in keymap:
-        if (keycode == "KEY_Q"):
-          self.device = device.path
-          break
-
-      if self.device is not None:
-        break
-
-    if self.device is None:
-      raise RuntimeError("Unable to locate a keyboard. Permissions to /dev/input/event* ?")
-
-    self.button_map = {}
+  # Do a select() on the joydev or use joydev.wait()
+  # then call this to read and parse all pending events
+  # Returns a list of tuples of
+  # returns "b0",1 for button presses
+  # returns "ax2",-0.4 for axis changes
+  # returns "ax6+",1 / "ax6-",0 for axes pressed/released like buttons
+  def get_event(self):
+    names = [ "b{}", "ax{}", "ax{}+", "ax{}-" ]
+    return [ (names[kind].format(number), value)
+             for kind,number,value in self._decode() ]
+
+  # "b3" -> (JS_BUTTON, 3), "ax6-" -> (JS_AXIS_MINUS, 6), etc.
+  # Returns None for anything that isn't a joystick control
+  @staticmethod
+  def parse_control(name):
+    try:
+      if name.startswith("ax"):
+        if name.endswith("+"): return JS_AXIS_PLUS, int(name[2:-1])
+        if name.endswith("-"): return JS_AXIS_MINUS, int(name[2:-1])
+        return JS_AXIS, int(name[2:])
+      if name.startswith("b"):
+        return JS_BUTTON, int(name[1:])
+    except ValueError:
+      pass
+    return None
+
+  # Turn {control name: [functions]} into a dispatch table,
+  # indexed by kind and then event number
+  def compile(self, bindings):
+    table = [ {}, {}, {}, {} ]
+    for control,functions in bindings.items():
+      parsed = self.parse_control(control)
+      if parsed is None:
+        sys.stderr.write("WARNING: {} is not a joystick control\n".format(control))
+        continue
+      kind,number = parsed
+      table[kind][number] = tuple(functions)
+    return table
+
+  # Like get_event(), but calls the functions bound to each control
+  def dispatch(self, table):
+    for kind,number,value in self._decode():
+      functions = table[kind].get(number)
+      if functions is None: continue
+      for f in functions:
+        f(value)
+
+
+# Where the path of the last keyboard found is remembered between launches
+KEYBOARD_CACHE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "uware", "keyboard.json")
+
+# Short key name <-> evdev key code, built on first use
+KEY_NAMES = None
+KEY_CODES = None
+
+def _key_tables():
+  global KEY_NAMES, KEY_CODES
+  if KEY_NAMES is None:
+    names = {}
     # Lazy extraction of all the evdev keycodes
     # If a key is named KEY_VIDEO_PREV, we will map it to "video_prev"
     # This is less sensitive to portability issues, since the keyboard isn't really
@@ -271,13 +371,156 @@ class Keyboard:
     for code,name in evdev.ecodes.KEY.items():
       if isinstance(name, str):
         short_name = name.replace("KEY_", "").lower()
-        self.button_map[code] = short_name
+        names[code] = short_name
+
+    # And back, from short name to key code
+    KEY_CODES = { name: code for code,name in names.items() }
+    KEY_NAMES = names
+  return KEY_NAMES, KEY_CODES
+
 
+class Keyboard:
+
+  def __init__(self, cache_path=KEYBOARD_CACHE):
+    self.cache_path = cache_path
+    self.device = None
+    self.identity = None
+    self.evdev = None
+
+    # May still be None, if so start() looks again
+    self._find()
+
+  # Sets device and identity to a keyboard, if there is one
+  def _find(self):
+    # Checking the one we found last time is much cheaper than
+    # opening every input device there is
+    found = self._cached_device(self.cache_path)
+
+    if found is None:
+      found = self._probe()
+      if found is not None:
+        self._store_cache(self.cache_path, *found)
+
+    if found is None:
+      self.device, self.identity = None, None
+    else:
+      self.device, self.identity = found
+
+  @property
+  def button_map(self):
+    return _key_tables()[0]
+
+  @property
+  def key_codes(self):
+    return _key_tables()[1]
+
+  # Tells if the device at a path is still the same physical device
+  @staticmethod
+  def _identity(device):
+    info = device.info
+    return [ device.name, device.phys, device.uniq,
+             info.bustype, info.vendor, info.product, info.version ]
+
+  @staticmethod
+  def _is_keyboard(device):
+    # Non-verbose capabilities are plain numbers, no name lookups
+    keys = device.capabilities(verbose=False).get(evdev.ecodes.EV_KEY, [])
+    return evdev.ecodes.KEY_Q in keys
+
+  # Go through available devices and pick the first that seems
+  # to be a keyboard. Returns its (path, identity)
+  def _probe(self):
+    for path in evdev.list_devices():
+      try:
+        device = evdev.InputDevice(path)
+      except OSError:
+        continue
+
+      try:
+        if self._is_keyboard(device):
+          return device.path, self._identity(device)
+      finally:
+        device.close()
+
+    return None
+
+  def _cached_device(self, cache_path):
+    try:
+      with open(cache_path) as f:
+        cached = json.load(f)
+      device = evdev.InputDevice(cached["path"])
+    except (OSError, ValueError, KeyError, TypeError):
+      return None
+
+    try:
+      # Device numbers get reused, so make sure it's the same one
+      if self._identity(device) == cached["identity"]:
+        return device.path, cached["identity"]
+      return None
+    finally:
+      device.close()
+
+  def _store_cache(self, cache_path, path, identity):
+    cached = { "path": path, "identity": identity }
+    try:
+      os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+      tmp = "{}.{}.tmp".format(cache_path, os.getpid())
+      with open(tmp, "w") as f:
+        json.dump(cached, f)
+      os.replace(tmp, cache_path)
+    except OSError:
+      # Only costs a slower start next time
+      pass
+
+
+  # The device at our path, if it's still the keyboard we found
+  def _open(self):
+    if self.device is None: return None
+    try:
+      device = evdev.InputDevice(self.device)
+    except OSError:
+      return None
+
+    # Unplugged, and the number given to some other device since
+    if self._identity(device) != self.identity:
+      device.close()
+      return None
+    return device
 
   def start(self):
     if (self.evdev is not None): return
 
-    self.evdev = evdev.InputDevice(self.device)
+    device = self._open()
+    if device is None:
+      # Unplugged or replaced since we last looked
+      self._find()
+      device = self._open()
+
+    if device is None:
+      raise RuntimeError("Unable to locate a keyboard. Permissions to /dev/input/event* ?")
+
+    self.evdev = device
+
+  # A new event device we're waiting for, if it's a keyboard.
+  # Only that one device is opened to check, so a hotplug doesn't
+  # hold up the other devices. It then becomes the one start() opens.
+  def watches(self, name):
+    if not name.startswith("event"): return False
+
+    try:
+      device = evdev.InputDevice(os.path.join("/dev/input", name))
+    except OSError:
+      # Not ours to read yet, udev changes the permissions right after
+      return False
+
+    try:
+      if not self._is_keyboard(device): return False
+      self.device, self.identity = device.path, self._identity(device)
+    finally:
+      device.close()
+
+    self._store_cache(self.cache_path, self.device, self.identity)
+    return True
 
   def stop(self):
     if (self.evdev is None): return
@@ -287,8 +530,8 @@ class Keyboard:
   def fileno(self):
     return self.evdev.fd
 
-  def wait(self):
-    ready,_,_ = select.select([self], [], [], 0.5)
+  def wait(self, timeout=0.5):
+    ready,_,_ = select.select([self], [], [], timeout)
     if len(ready) > 0: return True
     return False
 
@@ -305,13 +548,237 @@ class Keyboard:
             sys.stderr.write("WARNING: Unhandled keyboard input code {}".format(ev.code))
     return ret
 
+  # Turn {key name: [functions]} into a dispatch table by key code
+  def compile(self, bindings):
+    table = {}
+    for key,functions in bindings.items():
+      # Names that aren't evdev keys can never be pressed
+      if key not in self.key_codes: continue
+      table[self.key_codes[key]] = tuple(functions)
+    return table
+
+  # Like get_event(), but calls the functions bound to each key
+  def dispatch(self, table):
+    EV_KEY = evdev.ecodes.EV_KEY
+    for ev in self.evdev.read():
+      if ev.type != EV_KEY: continue
+      # ev.val == 1 for press, 0 for release
+      if ev.value != 0 and ev.value != 1: continue
+      functions = table.get(ev.code)
+      if functions is None: continue
+      for f in functions:
+        f(ev.value)
+
+
+# The function to call for one (controller, event)
+def bind_handler(input_handler, controller, event):
+  if hasattr(input_handler, "bind"):
+    return input_handler.bind(controller, event)
+  return functools.partial(input_handler.on_input, controller, event)
+
+
+# Watches a directory for files coming and going
+class Inotify:
+  IN_ATTRIB = 0x004
+  IN_CREATE = 0x100
+  IN_DELETE = 0x200
+
+  # struct inotify_event, without the name
+  EVENT = struct.Struct('iIII')
+
+  def __init__(self, path, mask):
+    libc = ctypes.CDLL(None, use_errno=True)
+
+    self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if self.fd < 0:
+      errno = ctypes.get_errno()
+      raise OSError(errno, os.strerror(errno))
+
+    if libc.inotify_add_watch(self.fd, path.encode(), mask) < 0:
+      errno = ctypes.get_errno()
+      os.close(self.fd)
+      raise OSError(errno, os.strerror(errno), path)
+
+  def fileno(self):
+    return self.fd
+
+  def close(self):
+    os.close(self.fd)
+
+  # Returns a list of (mask, file name) for everything that happened
+  def read(self):
+    ret = []
+    while True:
+      try:
+        buf = os.read(self.fd, 4096)
+      except BlockingIOError:
+        break
+
+      pos = 0
+      while pos < len(buf):
+        wd,mask,cookie,length = self.EVENT.unpack_from(buf, pos)
+        pos += self.EVENT.size
+        name = buf[pos:pos+length].rstrip(b"\0").decode(errors="replace")
+        pos += length
+        ret += [ (mask, name) ]
+    return ret
+
+
+# Keeps the input devices open, as far as that's possible.
+#
+# Devices that can't be opened, or that fail while reading, are set
+# aside and the rest keep working. When something shows up in
+# /dev/input, the devices waiting for it are opened then and there,
+# from the input thread's own loop.
+class DeviceManager:
+  def __init__(self, handlers, epoll):
+    self.handlers = handlers
+    self.epoll = epoll
+
+    # fd -> handler, for the devices that are open
+    self.attached = {}
+    self.detached = set(handlers)
+
+    self.inotify = None
+
+  def _attach(self, handler):
+    try:
+      handler.start()
+    except (OSError, RuntimeError) as e:
+      sys.stderr.write("{} unavailable: {}\n".format(handler.device, e))
+      return False
+
+    fd = handler.fileno()
+    self.epoll.register(fd, select.EPOLLIN)
+    self.attached[fd] = handler
+    self.detached.discard(handler)
+    return True
+
+  def _detach(self, fd):
+    handler = self.attached.pop(fd)
+    self.epoll.unregister(fd)
+    try:
+      handler.stop()
+    except OSError:
+      pass
+    self.detached.add(handler)
+
+  def attach_all(self):
+    if self.inotify is None:
+      try:
+        self.inotify = Inotify("/dev/input", Inotify.IN_CREATE | Inotify.IN_ATTRIB | Inotify.IN_DELETE)
+        self.epoll.register(self.inotify.fileno(), select.EPOLLIN)
+      except OSError as e:
+        sys.stderr.write("Not watching for new input devices: {}\n".format(e))
+
+    for handler in self.handlers:
+      if handler in self.detached:
+        self._attach(handler)
+
+  def detach_all(self):
+    for fd in list(self.attached):
+      self._detach(fd)
+
+    if self.inotify is not None:
+      self.epoll.unregister(self.inotify.fileno())
+      self.inotify.close()
+      self.inotify = None
+
+  def _hotplug(self):
+    for mask,name in self.inotify.read():
+      if mask & Inotify.IN_DELETE:
+        for fd,handler in list(self.attached.items()):
+          if handler.device is not None and os.path.basename(handler.device) == name:
+            sys.stderr.write("{} unplugged\n".format(handler.device))
+            self._detach(fd)
+      else:
+        # Created, or permissions changed (udev does that right after)
+        for handler in list(self.detached):
+          if handler.watches(name) and self._attach(handler):
+            sys.stderr.write("{} attached\n".format(handler.device))
+
+  # Deal with one ready fd from the epoll
+  def handle(self, fd, mask, DISPATCH):
+    if self.inotify is not None and fd == self.inotify.fileno():
+      self._hotplug()
+      return
+
+    handler = self.attached.get(fd)
+    if handler is None: return
+
+    try:
+      if mask & (select.EPOLLERR | select.EPOLLHUP):
+        raise OSError("device hung up")
+
+      # Controls like "ax1 moved to 0.32" go straight to
+      # whatever was bound to them, like "axis-X1" of controller1
+      handler.dispatch(DISPATCH[handler])
+
+    except OSError as e:
+      sys.stderr.write("{} failed: {}\n".format(handler.device, e))
+      self._detach(fd)
+
+
+# Open the devices a game configuration uses.
+# Returns (DEVICES, CONTROLLER_MAP)
+#
+# For each loaded input device, there's an object in DEVICES
+# For each device, there is a map of
+# button/axis/key/whatever to a tuple of
+# (controller, event)
+#
+def load_devices(game_conf):
+  DEVICES = {}
+  CONTROLLER_MAP = {}
+
+  DEVICES["keyboard"] = Keyboard()
+  CONTROLLER_MAP[DEVICES["keyboard"]] = {}
+
+  for controller in [ "controller1", "controller2", "console" ]:
+
+    if controller not in game_conf:
+      raise RuntimeError("Controller {} missing.".format(controller))
+
+    cmap = game_conf[controller]
+
+    if "device" not in cmap:
+      raise RuntimeError("Controller {} does not have a device specified.".format(controller))
+
+    device = cmap["device"]
+    if device not in DEVICES:
+      # Previously unused joystick device
+      DEVICES[device] = Joydev(device)
+      CONTROLLER_MAP[DEVICES[device]] = {}
+
+    for event,button in cmap.items():
+      if event == "device": continue
+      #sys.stderr.write("Mapping {} to ({}, {})\n".format(button, controller, event))
+      CONTROLLER_MAP[DEVICES[device]][button] = (controller, event)
+
+  return DEVICES, CONTROLLER_MAP
+
+# The mapping compiled down to tables from raw input to functions,
+# so nothing needs to be looked up by name while running.
+# Returns a map from each device to its dispatch table.
+def compile_dispatch(CONTROLLER_MAP, input_handler):
+  DISPATCH = {}
+  for handler,cmap in CONTROLLER_MAP.items():
+    bindings = {}
+    for control,(controller,event) in cmap.items():
+      f = bind_handler(input_handler, controller, event)
+      if f is not None:
+        bindings[control] = [ f ]
+    DISPATCH[handler] = handler.compile(bindings)
+  return DISPATCH
+
 
 # A persistent thread that checks all input devices and
 # routes the proper events to the input handler
 class InputThread(threading.Thread):
 
-  def __init__(self, input_handler, game_conf):
-    threading.Thread.__init__(self)
+  # If given a Profiler, input handling is timed as the "input" scope
+  def __init__(self, input_handler, game_conf, profiler=None):
+    threading.Thread.__init__(self, name="input")
 
     # Thread management
     self.do_shutdown = False
@@ -319,57 +786,55 @@ class InputThread(threading.Thread):
     self.is_enabled.clear()
 
     self.input_handler = input_handler
+    self.profiler = profiler
 
+    self.DEVICES, self.CONTROLLER_MAP = load_devices(game_conf)
+    self.DISPATCH = compile_dispatch(self.CONTROLLER_MAP, input_handler)
 
-    # For each loaded input device, there's an object in DEVICES
-    # For each device, there is a map of 
-    # button/axis/key/whatever to a tuple of
-    # (controller, event)
-    #
-    self.DEVICES = {}
-    self.CONTROLLER_MAP = {}
-
-    self.DEVICES["keyboard"] = Keyboard()
-    self.CONTROLLER_MAP[self.DEVICES["keyboard"]] = {}
-
-    for controller in [ "controller1", "controller2", "console" ]:
-
-      if controller not in game_conf:
-        raise RuntimeError("Controller {} missing.".format(controller))
-
-      cmap = game_conf[controller]
-
-      if "device" not in cmap:
-        raise RuntimeError("Controller {} does not have a device specified.".format(controller))
-
-      device = cmap["device"]
-      if device not in self.DEVICES:
-        # Previously unused joystick device
-        self.DEVICES[device] = Joydev(device)
-        self.CONTROLLER_MAP[self.DEVICES[device]] = {}
+    # Devices are registered with epoll while they're open.
+    # The pipe wakes the thread up right away on pause/shutdown.
+    self.epoll = select.epoll()
+    self.manager = DeviceManager(list(self.DEVICES.values()), self.epoll)
+    self.wake_r, self.wake_w = os.pipe()
+    os.set_blocking(self.wake_r, False)
+    os.set_blocking(self.wake_w, False)
+    self.epoll.register(self.wake_r, select.EPOLLIN)
 
-      for event,button in cmap.items():
-        if event == "device": continue
-        #sys.stderr.write("Mapping {} to ({}, {})\n".format(button, controller, event))
-        self.CONTROLLER_MAP[self.DEVICES[device]][button] = (controller, event)
+    # Held while devices are read, so they aren't closed under our feet
+    self.device_lock = threading.RLock()
 
     sys.stderr.write("Spawning input thread\n")
     self.start()
 
 
+  def _wake(self):
+    try:
+      os.write(self.wake_w, b"\0")
+    except BlockingIOError:
+      # Pipe is full, the thread is waking up anyway
+      pass
+
+  def _drain_wake(self):
+    try:
+      while os.read(self.wake_r, 64): pass
+    except BlockingIOError:
+      pass
+
   def resume(self):
-    for dev,handler in self.DEVICES.items():
-      handler.start()
+    with self.device_lock:
+      self.manager.attach_all()
     self.is_enabled.set()
 
   def pause(self):
     self.is_enabled.clear()
-    for dev,handler in self.DEVICES.items():
-      handler.stop()
+    self._wake()
+    with self.device_lock:
+      self.manager.detach_all()
 
   def shutdown(self):
     self.do_shutdown = True
     self.is_enabled.set()
+    self._wake()
 
 
   def run(self):
@@ -379,32 +844,160 @@ class InputThread(threading.Thread):
       self.is_enabled.wait()
       if self.do_shutdown: break
 
-      ready,_,_ = select.select([ handler for _,handler in self.DEVICES.items()] , [], [], 0.1)
-      if len(ready) > 0:
-        # Get control events like "ax1 moved to 0.32"
-        for handler in ready:
-          cmap = self.CONTROLLER_MAP[handler]
-          inputs = handler.get_event()
+      # Sleeps until there's input or someone wakes us
+      ready = self.epoll.poll()
+
+      with self.device_lock:
+        for fd,mask in ready:
+          if fd == self.wake_r:
+            self._drain_wake()
+            continue
+
+          # Paused while we were waiting
+          if not self.is_enabled.is_set(): break
+
+          if self.profiler is None:
+            self.manager.handle(fd, mask, self.DISPATCH)
+          else:
+            with self.profiler.scope("input"):
+              self.manager.handle(fd, mask, self.DISPATCH)
+
+
+
+
+# Hands input over to the game thread instead of calling the game
+# straight from the input thread.
+#
+# Pass an InputQueue to setup() as the input handler, and call drain()
+# once per game tick: the queued events are delivered to the real
+# handler there, on the game's own thread.
+#
+# It's a fixed-size ring with one writer (the input thread) and one
+# reader (the game), each only moving its own index, so neither side
+# takes a lock or waits for the other. If the game stops draining,
+# new events are dropped (and counted) rather than blocking input.
+class InputQueue:
+  def __init__(self, input_handler, capacity=256):
+    self.input_handler = input_handler
+    self.capacity = capacity
+    self.slots = [ None ] * capacity
+
+    # Only written by the input thread
+    self.head = 0
+    self.dropped = 0
+
+    # Only written by the game thread
+    self.tail = 0
+
+    # Seconds from an event arriving to it being handled
+    self.last_latency = 0.0
+    self.max_latency = 0.0
+
+  # Events waiting to be drained
+  def __len__(self):
+    return self.head - self.tail
+
+  # Input thread side
+  def on_input(self, controller, event, value):
+    self._push(controller, event, None, value)
+
+  # Input thread side, when compiled. The handler's own binding is
+  # looked up now, and called when the event is drained.
+  def bind(self, controller, event):
+    target = bind_handler(self.input_handler, controller, event)
+    if target is None: return None
+    return functools.partial(self._push, controller, event, target)
+
+  def _push(self, controller, event, target, value):
+    head = self.head
+    if head - self.tail >= self.capacity:
+      self.dropped += 1
+      return
+
+    self.slots[head % self.capacity] = (time.monotonic(), controller, event, target, value)
+
+    # Publish only once the slot is filled in
+    self.head = head + 1
+
+  # Game thread side. Returns the number of events delivered.
+  def drain(self):
+    tail = self.tail
+    head = self.head
+    count = head - tail
+
+    while tail < head:
+      i = tail % self.capacity
+      stamp,controller,event,target,value = self.slots[i]
+      self.slots[i] = None
 
-          if inputs is None: continue
+      if target is None:
+        self.input_handler.on_input(controller, event, value)
+      else:
+        target(value)
 
-          # Mape those controls to events like "axis-X1"
-          for control,value in inputs:
-            if control in cmap:
-              controller,event = cmap[control]
-              self.input_handler.on_input(controller, event, value)
+      latency = time.monotonic() - stamp
+      self.last_latency = latency
+      self.max_latency = max(self.max_latency, latency)
 
+      tail += 1
+      self.tail = tail
 
+    return count
+
+
+# The asyncio way, without the input thread:
+#
+#   async for controller,event,value in input_stream(game_conf):
+#     ...
+#
+# The devices are watched by the running event loop itself, and are
+# opened when the iteration starts and closed when it ends. Like in
+# the input thread, a DeviceManager keeps going without the devices
+# that are missing or fail, and picks them up when they come back.
+# If the consumer falls more than maxsize events behind, the newest
+# ones are dropped.
+async def input_stream(game_conf=None, maxsize=256):
+  if game_conf is None: game_conf = DEFAULT_MAP
+  loop = asyncio.get_running_loop()
+  queue = asyncio.Queue(maxsize)
+
+  class Collector:
+    def on_input(self, controller, event, value):
+      if not queue.full():
+        queue.put_nowait((controller, event, value))
+
+  DEVICES, CONTROLLER_MAP = load_devices(game_conf)
+  DISPATCH = compile_dispatch(CONTROLLER_MAP, Collector())
+
+  # The loop only watches the epoll, which has the devices in it
+  epoll = select.epoll()
+  manager = DeviceManager(list(DEVICES.values()), epoll)
+
+  def ready():
+    for fd,mask in epoll.poll(0):
+      manager.handle(fd, mask, DISPATCH)
+
+  try:
+    manager.attach_all()
+    loop.add_reader(epoll.fileno(), ready)
+
+    while True:
+      yield await queue.get()
+
+  finally:
+    loop.remove_reader(epoll.fileno())
+    manager.detach_all()
+    epoll.close()
 
 
 INPUT_THREAD = None
 
 
-def setup(input_handler, game_conf):
+def setup(input_handler, game_conf, profiler=None):
   global INPUT_THREAD
   if INPUT_THREAD is not None: return
   if game_conf is None: game_conf = DEFAULT_MAP
-  INPUT_THREAD = InputThread(input_handler, game_conf)
+  INPUT_THREAD = InputThread(input_handler, game_conf, profiler)
 
 def start():
   global INPUT_THREAD
@@ -444,6 +1037,14 @@ def main():
     setup(dummy_handler, DEFAULT_MAP)
     start()
 
+  elif (False):
+    async def dump():
+      async for controller,event,value in input_stream(DEFAULT_MAP):
+        print("{} {} -> {}".format(controller, event, value))
+        if (event == "quit"): break
+
+    asyncio.run(dump())
+
   elif (False):
     if (False):
       # Open the joystick device.
@@ -1,7 +1,18 @@
-from pyglet.gl import *
+import math
+
+# Nothing in here needs a display. pyglet is only imported when
+# something is actually drawn, so the simulation can run headless.
 
 
 class Entity:
+  # A fixed set of attributes and no __dict__, which makes entities
+  # about half the size and attribute access a little quicker. Big
+  # static worlds are mostly blocks, so that adds up.
+  # Subclasses that don't declare __slots__ get a __dict__ as usual.
+  __slots__ = ( "x", "y", "vx", "vy", "width", "height",
+                "bump_up", "bump_down", "bump_left", "bump_right",
+                "asleep", "on_wake", "name" )
+
   def __init__(self, x, y, width, height, name="Entity"):
 
     #
@@ -20,8 +31,22 @@ class Entity:
     self.bump_left  = False
     self.bump_right = False
 
+    # Set by a SleepSystem, which skips this entity while it's asleep
+    self.asleep = False
+    self.on_wake = None
+
     self.name = name
 
+  # Nothing will change for this entity unless something touches it
+  def at_rest(self):
+    return self.vx == 0 and self.vy == 0
+
+  def wake(self):
+    if not self.asleep: return
+    self.asleep = False
+    if self.on_wake is not None:
+      self.on_wake(self)
+
   @property
   def right(self):
     return self.x + self.width
@@ -36,81 +61,144 @@ class Entity:
   # If snap is set, keeps the objects apart.
   # Returns True if there is any collision
   def collide(self, ent, snap=False):
+    # Called a lot, so the bounds are read once instead of going
+    # through the properties every time
+    x = self.x
+    y = self.y
+    right = x + self.width
+    top = y + self.height
+
+    ent_x = ent.x
+    ent_y = ent.y
+    ent_right = ent_x + ent.width
+    ent_top = ent_y + ent.height
+
     overlap_v = (
-                 (ent.y  <= self.y <= ent.top) or
-                 (self.y <= ent.y  <= self.top)
+                 (ent_y <= y <= ent_top) or
+                 (y <= ent_y <= top)
                 )
     overlap_h = (
-                 (ent.x  <= self.x <= ent.right) or
-                 (self.x <= ent.x  <= self.right)
+                 (ent_x <= x <= ent_right) or
+                 (x <= ent_x <= right)
                 )
 
     collision = False
 
     if overlap_h:
       # Check for up or down bump
-      top = ent.y <= self.top <= ent.top
-      bottom = ent.y <= self.y <= ent.top
+      hit_top = ent_y <= top <= ent_top
+      hit_bottom = ent_y <= y <= ent_top
 
       move_top = self.vy > 0 or ent.vy < 0
       #move_bottom = self.vy < 0 or ent.vy > 0
 
-      if (move_top and top and not bottom):
+      if (move_top and hit_top and not hit_bottom):
         #print("{} U to {}".format(self.name, ent.name))
         self.bump_up = True
         ent.bump_down = True
-        if (snap): self.y = ent.y-self.height
+        if (snap): self.y = ent_y-self.height
         collision = True
 
-      if (bottom and not top):
+      if (hit_bottom and not hit_top):
         #print("{} D to {} at {}".format(self.name, ent.name, self.y))
         self.bump_down = True
         ent.bump_up = True
-        if (snap): self.y = ent.top
+        if (snap): self.y = ent_top
         collision = True
 
     if (collision): return collision
 
     if overlap_v:
-      left  = ent.x <= self.x <= ent.right
-      right = ent.x <= self.right <= ent.right
+      left  = ent_x <= x <= ent_right
+      hit_right = ent_x <= right <= ent_right
 
       move_right = self.vx > 0 or ent.vx < 0
       move_left = self.vx < 0 or ent.vx > 0
 
       # Check for left or right bump
-      if (move_left and left and not right):
+      if (move_left and left and not hit_right):
         #print("{} L to {} at {}".format(self.name, ent.name, self.x))
         self.bump_left = True
         ent.bump_right = True
-        if (snap): self.x = ent.right
+        if (snap): self.x = ent_right
         collision = True
 
-      if (move_right and right and not left):
+      if (move_right and hit_right and not left):
         #print("{} R to {}".format(self.name, ent.name))
         self.bump_right = True
         ent.bump_left = True
-        if (snap): self.x = ent.x-self.width
+        if (snap): self.x = ent_x-self.width
         collision = True
 
 
     return collision
 
+  # Time of impact when moving by (dx, dy) towards ent, which stays put.
+  # Returns (t, vertical) if the move reaches ent, t being the
+  # fraction of the move done when they meet (0 to 1) and vertical
+  # telling if it's a top/bottom hit. Returns None for a miss, and
+  # for boxes that already overlap, which collide() deals with.
+  # Sliding along a touching edge isn't a hit.
+  def sweep(self, ent, dx, dy):
+    if dx > 0:
+      tx0 = (ent.x - self.right) / dx
+      tx1 = (ent.right - self.x) / dx
+    elif dx < 0:
+      tx0 = (ent.right - self.x) / dx
+      tx1 = (ent.x - self.right) / dx
+    elif ent.x < self.right and self.x < ent.right:
+      tx0 = -math.inf
+      tx1 = math.inf
+    else:
+      return None
+
+    if dy > 0:
+      ty0 = (ent.y - self.top) / dy
+      ty1 = (ent.top - self.y) / dy
+    elif dy < 0:
+      ty0 = (ent.top - self.y) / dy
+      ty1 = (ent.y - self.top) / dy
+    elif ent.y < self.top and self.y < ent.top:
+      ty0 = -math.inf
+      ty1 = math.inf
+    else:
+      return None
+
+    entry = max(tx0, ty0)
+    exit = min(tx1, ty1)
+
+    # Only touching a corner on the way past isn't a hit either
+    if entry >= exit or entry < 0 or entry > 1: return None
+
+    # Vertical wins a tie, like in collide()
+    return entry, ty0 >= tx0
+
   def draw(self, window):
     print("Entity not being drawn...")
 
 
 class ColoredBlock(Entity):
+  __slots__ = ( "color", )
+
   def __init__(self, x, y, width, height, color, name="Block"):
     Entity.__init__(self, x, y, width, height, name)
 
     self.color = color
-    self.points = ( x, y,
-                    self.right, y,
-                    self.right, self.top,
-                    x, self.top
-                  )
+
+  # Made when drawn, so it's never out of date if the block moves
+  @property
+  def points(self):
+    x = self.x
+    y = self.y
+    right = x + self.width
+    top = y + self.height
+    return ( x, y,
+             right, y,
+             right, top,
+             x, top
+           )
 
   def draw(self, window):
+    import pyglet
     pyglet.graphics.draw(4, pyglet.gl.GL_QUADS,
                         ('v2f', self.points))
@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
 import math
-import pyglet
 
 from physics import Entity
 
@@ -104,6 +103,14 @@ class Player(Entity):
 
 
   def tick(self, dt):
+    self.accelerate(dt)
+
+    self.x += self.vx
+    self.y += self.vy
+
+  # The velocity part of tick(), without moving. For moving with
+  # SpatialHash.sweep() instead.
+  def accelerate(self, dt):
 
     # Gravity
     if (not self.bump_down):
@@ -114,17 +121,21 @@ class Player(Entity):
     self._move()
     self._bump()
 
-    self.x += self.vx
-    self.y += self.vy
-
 
   def draw(self, window):
     self.sprite.draw(window, self.x, self.y)
 
+  # Standing still on something, and not trying to go anywhere
+  def at_rest(self):
+    return (self.vx == 0 and self.vy == 0 and self.bump_down and
+            self.vx_target == 0 and not self.jumping)
+
   # value is -1 (full left) to 1 (full right)
   # 0 stops.
   def move(self, value):
     target_speed = value * self.vx_max
+    if (target_speed != self.vx_target):
+      self.wake()
     self.vx_target = target_speed
 
   def jump(self, active):
@@ -137,13 +148,24 @@ class Player(Entity):
     # Start a new jump
     if (self.bump_down):
       if (active):
+        self.wake()
         self.jumping = True
         self.jump_strength = self.jump_strength_max
 
 class PlayerController:
 
-  def __init__(self, p1):
+  # on_quit is called for the console's "quit". By default it ends
+  # the pyglet app, which is only imported then.
+  def __init__(self, p1, on_quit=None):
     self.p1 = p1
+    self.on_quit = on_quit
+
+  def _quit(self):
+    if self.on_quit is not None:
+      self.on_quit()
+      return
+    import pyglet
+    pyglet.app.exit()
 
   def on_input(self, controller, event, value):
     if controller == "controller1":
@@ -154,10 +176,44 @@ class PlayerController:
       pass
     else:
       if (event == "quit"):
-        pyglet.app.exit()
+        self._quit()
       return
 
 
+  # Compiled form of on_input(), see input_mapper
+  def bind(self, controller, event):
+    if controller == "controller1":
+      return self.bind_player(self.p1, event)
+    elif controller == "controller2":
+      #return self.bind_player(self.p2, event)
+      return None
+    else:
+      if (event == "quit"):
+        return lambda value: self._quit()
+      return None
+
+  # Same as move_player, with the event already decided
+  def bind_player(self, player, event):
+    def move(value):
+      # Dead zone
+      if (-0.1 <= value <= 0.1): value = 0
+      player.move(value)
+
+    # Map dpad to the same thing as the analog axis
+    if (event == "dpad-left"):
+      return lambda value: move(-1 * value)
+
+    if (event == "dpad-right"):
+      return lambda value: move(1 * value)
+
+    if (event == "axis-X1"):
+      return move
+
+    if (event == "button-A"):
+      return lambda value: player.jump(value == 1)
+
+    return None
+
   def move_player(self, player, event, value):
     # Map dpad to the same thing as the analog axis
     if (event == "dpad-left"):
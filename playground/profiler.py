@@ -0,0 +1,220 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+
+
+# Where does a frame's time go?
+#
+#   profiler = Profiler()
+#
+#   with profiler.scope("collide"):
+#     collide_world(...)
+#
+#   profiler.count("bullets", len(bullets))
+#   profiler.sample("queue depth", lambda: len(input_queue))
+#
+#   # once per rendered frame
+#   profiler.end_frame()
+#
+# Scopes can be opened from any thread, e.g. the input thread. Each
+# frame's scope times and counters go into a ring of the last
+# `frames` frames, which stats() summarizes (p50/p99 frame times and
+# so on). Every scope is also kept as a trace event, and
+# export_chrome_trace() writes those in the format chrome://tracing
+# and Perfetto read.
+#
+# A disabled profiler hands out one shared do-nothing scope and
+# returns right away from everything else, so the hooks can stay in
+# the game loop.
+
+
+class _NullScope:
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+NULL_SCOPE = _NullScope()
+
+
+class _Scope:
+  def __init__(self, profiler, name):
+    self.profiler = profiler
+    self.name = name
+
+  def __enter__(self):
+    self.start = time.perf_counter_ns()
+    return self
+
+  def __exit__(self, *exc):
+    self.profiler._record(self.name, self.start, time.perf_counter_ns())
+    return False
+
+
+# Nearest-rank percentile of a sorted list
+def _percentile(values, p):
+  if not values: return 0
+  rank = max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))
+  return values[rank]
+
+
+class Profiler:
+  def __init__(self, enabled=True, frames=600, trace_events=200000):
+    self.enabled = enabled
+
+    # The last `frames` frames, as (frame ns, {scope: ns}, {counter: n})
+    self.history = [ None ] * frames
+    self.frames = 0
+
+    # This frame so far. end_frame() swaps in new dicts, a scope
+    # ending on another thread right then may land in either frame.
+    self.scopes = {}
+    self.counters = {}
+
+    # name -> function, read at the end of every frame
+    self.samplers = {}
+
+    # (name, thread id, start ns, end ns), oldest dropped first
+    self.trace = deque(maxlen=trace_events)
+    self.thread_names = {}
+
+    self.epoch = time.perf_counter_ns()
+    self.frame_start = None
+
+  def scope(self, name):
+    if not self.enabled: return NULL_SCOPE
+    return _Scope(self, name)
+
+  # fn, but timed as a scope. Handy for scheduled callbacks.
+  def wrap(self, name, fn):
+    def timed(*args, **kwargs):
+      if not self.enabled: return fn(*args, **kwargs)
+      with _Scope(self, name):
+        return fn(*args, **kwargs)
+    return timed
+
+  def _record(self, name, start, end):
+    self.scopes[name] = self.scopes.get(name, 0) + (end - start)
+
+    thread = threading.current_thread()
+    if thread.ident not in self.thread_names:
+      self.thread_names[thread.ident] = thread.name
+    self.trace.append((name, thread.ident, start, end))
+
+  def count(self, name, n=1):
+    if not self.enabled: return
+    self.counters[name] = self.counters.get(name, 0) + n
+
+  def sample(self, name, fn):
+    self.samplers[name] = fn
+
+  def end_frame(self):
+    if not self.enabled: return
+    now = time.perf_counter_ns()
+
+    counters = self.counters
+    for name,fn in self.samplers.items():
+      counters[name] = fn()
+
+    if self.frame_start is not None:
+      self.history[self.frames % len(self.history)] = (now - self.frame_start, self.scopes, counters)
+      self.frames += 1
+      self.trace.append(("frame", threading.get_ident(), self.frame_start, now))
+
+    self.scopes = {}
+    self.counters = {}
+    self.frame_start = now
+
+  def _recent(self):
+    return [ h for h in self.history if h is not None ]
+
+  # Summary of the frames in the ring. Times are in milliseconds.
+  def stats(self):
+    recent = self._recent()
+    frame_times = sorted(h[0] / 1e6 for h in recent)
+
+    scopes = {}
+    counters = {}
+    for _,frame_scopes,frame_counters in recent:
+      for name,ns in frame_scopes.items():
+        scopes.setdefault(name, []).append(ns / 1e6)
+      for name,n in frame_counters.items():
+        counters.setdefault(name, []).append(n)
+
+    ret = {
+      "frames": len(recent),
+      "frame_p50": _percentile(frame_times, 50),
+      "frame_p99": _percentile(frame_times, 99),
+      "frame_max": frame_times[-1] if frame_times else 0,
+      "scopes": {},
+      "counters": {},
+    }
+
+    # Averaged over all frames, including the ones without the scope
+    for name,times in scopes.items():
+      times.sort()
+      ret["scopes"][name] = {
+        "mean": sum(times) / max(1, len(recent)),
+        "p99": _percentile(times, 99),
+      }
+
+    for name,values in counters.items():
+      ret["counters"][name] = {
+        "mean": sum(values) / len(values),
+        "max": max(values),
+      }
+
+    return ret
+
+  # stats() as a few lines of text
+  def report(self):
+    s = self.stats()
+    lines = [ "frame  p50 {:6.2f} ms  p99 {:6.2f} ms  max {:6.2f} ms".format(
+              s["frame_p50"], s["frame_p99"], s["frame_max"]) ]
+    for name,scope in sorted(s["scopes"].items()):
+      lines += [ "{:12} {:6.3f} ms  p99 {:6.3f} ms".format(name, scope["mean"], scope["p99"]) ]
+    for name,counter in sorted(s["counters"].items()):
+      lines += [ "{:12} {:8.1f}  max {}".format(name, counter["mean"], counter["max"]) ]
+    return "\n".join(lines)
+
+  def export_chrome_trace(self, path):
+    pid = os.getpid()
+    events = []
+    for ident,name in self.thread_names.items():
+      events += [ { "name": "thread_name", "ph": "M", "pid": pid, "tid": ident,
+                    "args": { "name": name } } ]
+
+    for name,ident,start,end in list(self.trace):
+      events += [ { "name": name, "cat": "uware", "ph": "X", "pid": pid, "tid": ident,
+                    "ts": (start - self.epoch) / 1000,
+                    "dur": (end - start) / 1000 } ]
+
+    with open(path, "w") as f:
+      json.dump({ "traceEvents": events, "displayTimeUnit": "ms" }, f)
+
+
+# The profiler's report drawn in a corner of a pyglet window.
+# pyglet is imported here rather than at the top, so the profiler
+# itself works headless.
+class ProfilerOverlay:
+  def __init__(self, profiler, window, every=30):
+    import pyglet
+
+    self.profiler = profiler
+    self.every = every
+    self.drawn = 0
+    self.label = pyglet.text.Label("", font_name="monospace", font_size=9,
+                                   x=8, y=window.height-8,
+                                   width=window.width-16, multiline=True,
+                                   anchor_y="top")
+
+  def draw(self):
+    # Laying out text isn't free, so it's only redone now and then
+    if self.drawn % self.every == 0:
+      self.label.text = self.profiler.report()
+    self.drawn += 1
+    self.label.draw()
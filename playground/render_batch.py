@@ -0,0 +1,110 @@
+import numpy as np
+import pyglet
+from pyglet.gl import *
+
+
+# Turns on alpha blending once for everything drawn in the group
+class BlendGroup(pyglet.graphics.OrderedGroup):
+  def set_state(self):
+    glEnable(GL_BLEND)
+    glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+
+  def unset_state(self):
+    glDisable(GL_BLEND)
+
+
+# Everything on screen in a single pyglet Batch
+#
+# Blocks and sprites are registered once and keep their vertex lists
+# for as long as they're in the layer. update() moves them to where
+# their entities are now, touching only the ones that moved, and
+# draw() is a single batch draw. Blocks are assumed to stay put
+# unless added with moving=True.
+#
+# Sprites that share a texture are drawn together, so the fewer
+# textures, the fewer draw calls.
+class RenderLayer:
+  def __init__(self):
+    self.batch = pyglet.graphics.Batch()
+
+    # Blocks behind, sprites in front
+    self.block_group = pyglet.graphics.OrderedGroup(0)
+    self.sprite_group = BlendGroup(1)
+
+    # entity -> (vertex list, bounds it was built from)
+    self.blocks = {}
+
+    # Blocks that can move, and need checking in update()
+    self.moving_blocks = set()
+
+    # entity -> pyglet sprite
+    self.sprites = {}
+
+  def _block_vertices(self, ent):
+    return ( ent.x, ent.y,
+             ent.right, ent.y,
+             ent.right, ent.top,
+             ent.x, ent.top )
+
+  def add_block(self, ent, moving=False):
+    if ent in self.blocks: return
+    vertices = self._block_vertices(ent)
+    usage = 'v2f/dynamic' if moving else 'v2f/static'
+    vlist = self.batch.add(4, GL_QUADS, self.block_group,
+                           (usage, vertices))
+    self.blocks[ent] = (vlist, vertices)
+    if moving:
+      self.moving_blocks.add(ent)
+
+  # A whole TileMap as one static vertex list.
+  # Returns the vertex list, delete() it to take the level away.
+  def add_tilemap(self, tilemap):
+    vertices = tilemap.vertices()
+    vlist = self.batch.add(len(vertices) // 2, GL_QUADS, self.block_group, 'v2f/static')
+
+    # Straight into the buffer, instead of a Python list of floats
+    np.ctypeslib.as_array(vlist.vertices)[:] = vertices
+    return vlist
+
+  def add_sprite(self, ent, image):
+    if ent in self.sprites: return
+    self.sprites[ent] = pyglet.sprite.Sprite(image, ent.x, ent.y,
+                                             batch=self.batch,
+                                             group=self.sprite_group)
+
+  # Swap the picture of a sprite, e.g. for a different animation state
+  def set_image(self, ent, image):
+    sprite = self.sprites[ent]
+    if sprite.image is not image:
+      sprite.image = image
+
+  def remove(self, ent):
+    if ent in self.blocks:
+      vlist,_ = self.blocks.pop(ent)
+      vlist.delete()
+      self.moving_blocks.discard(ent)
+    if ent in self.sprites:
+      self.sprites.pop(ent).delete()
+
+  # Move everything to the current entity positions.
+  # position(ent) can return a different place to draw a sprite,
+  # like FixedStepLoop.position.
+  def update(self, position=None):
+    for ent,sprite in self.sprites.items():
+      if position is None:
+        x,y = ent.x, ent.y
+      else:
+        x,y = position(ent)
+
+      if sprite.x != x or sprite.y != y:
+        sprite.position = (x, y)
+
+    for ent in self.moving_blocks:
+      vlist,vertices = self.blocks[ent]
+      current = self._block_vertices(ent)
+      if current != vertices:
+        vlist.vertices[:] = current
+        self.blocks[ent] = (vlist, current)
+
+  def draw(self):
+    self.batch.draw()
@@ -0,0 +1,207 @@
+import functools
+import struct
+
+
+# Recording input, and playing it back later
+#
+# An InputRecorder sits between input_mapper (or an InputQueue) and
+# the real handler, like a PlayerController. Everything passing
+# through is written to a file with the simulation tick it was
+# handled on. An InputReplayer reads that file and hands the same
+# events to a handler on the same ticks, with no devices involved.
+#
+# Both count ticks themselves. Call advance() once per simulation
+# step, at the point where input is normally applied:
+#
+#   def tick(dt):
+#     input_queue.drain()      # or just replayer.advance()
+#     recorder.advance()
+#     player1.tick(dt)
+#     ...
+#
+# Given the same starting state, the replayed run is identical to
+# the recorded one, which makes physics bugs reproducible and lets
+# movement tuning be checked without anyone at the controls.
+#
+# File format, all little-endian:
+#   header:  "UWIR", u16 version
+#   records: u32 tick, u8 control, then
+#              f64 value                   for controls 0-254
+#              u8 len, controller,
+#              u8 len, event               for 255, which defines the
+#                                          next control number
+#
+# Controls are numbered in the order they first show up, so the file
+# doesn't repeat the names for every event.
+
+MAGIC = b"UWIR"
+VERSION = 1
+
+HEADER = struct.Struct("<4sH")
+RECORD = struct.Struct("<IB")
+VALUE = struct.Struct("<d")
+
+NEW_CONTROL = 0xff
+
+
+# Same as input_mapper.bind_handler. Not imported from there, so
+# replaying works without the device libraries.
+def _bind(input_handler, controller, event):
+  if hasattr(input_handler, "bind"):
+    return input_handler.bind(controller, event)
+  return functools.partial(input_handler.on_input, controller, event)
+
+
+class InputRecorder:
+  def __init__(self, input_handler, path):
+    self.input_handler = input_handler
+    self.tick = 0
+
+    # (controller, event) -> control number
+    self.controls = {}
+
+    self.events = 0
+    self.pending = False
+
+    self.f = open(path, "wb")
+    self.f.write(HEADER.pack(MAGIC, VERSION))
+
+  def _control(self, controller, event):
+    key = (controller, event)
+    index = self.controls.get(key)
+    if index is not None: return index
+
+    index = len(self.controls)
+    if index >= NEW_CONTROL:
+      raise ValueError("Too many different controls to record")
+
+    c = controller.encode("utf-8")
+    e = event.encode("utf-8")
+    self.f.write(RECORD.pack(self.tick, NEW_CONTROL))
+    self.f.write(bytes([ len(c) ]) + c + bytes([ len(e) ]) + e)
+
+    self.controls[key] = index
+    return index
+
+  def _record(self, controller, event, value):
+    self.f.write(RECORD.pack(self.tick, self._control(controller, event)))
+    self.f.write(VALUE.pack(value))
+    self.events += 1
+    self.pending = True
+
+  def on_input(self, controller, event, value):
+    self._record(controller, event, value)
+    self.input_handler.on_input(controller, event, value)
+
+  def bind(self, controller, event):
+    target = _bind(self.input_handler, controller, event)
+    if target is None: return None
+
+    def record(value):
+      self._record(controller, event, value)
+      target(value)
+    return record
+
+  # End of input for this tick
+  def advance(self):
+    self.tick += 1
+
+    # Written out tick by tick, so a crash still leaves the
+    # input that led up to it
+    if self.pending:
+      self.f.flush()
+      self.pending = False
+
+  def close(self):
+    if not self.f.closed:
+      self.f.close()
+
+
+# Returns a list of (tick, controller, event, value) from a recording
+def load_recording(path):
+  with open(path, "rb") as f:
+    data = f.read()
+
+  if len(data) < HEADER.size:
+    raise ValueError("{} is not an input recording".format(path))
+  magic,version = HEADER.unpack_from(data)
+  if magic != MAGIC:
+    raise ValueError("{} is not an input recording".format(path))
+  if version != VERSION:
+    raise ValueError("{}: unsupported recording version {}".format(path, version))
+
+  controls = []
+  events = []
+  pos = HEADER.size
+
+  # A record cut short at the end means the game died while writing
+  # it. Everything before that is still good.
+  try:
+    while pos < len(data):
+      tick,index = RECORD.unpack_from(data, pos)
+      pos += RECORD.size
+
+      if index == NEW_CONTROL:
+        names = []
+        for _ in range(2):
+          length = data[pos]
+          names += [ data[pos+1:pos+1+length].decode("utf-8") ]
+          pos += 1 + length
+        controls += [ tuple(names) ]
+        continue
+
+      value, = VALUE.unpack_from(data, pos)
+      pos += VALUE.size
+
+      controller,event = controls[index]
+      events += [ (tick, controller, event, value) ]
+  except (struct.error, IndexError):
+    pass
+
+  return events
+
+
+class InputReplayer:
+  def __init__(self, input_handler, path):
+    self.input_handler = input_handler
+    self.events = load_recording(path)
+    self.tick = 0
+
+    # Next event to deliver
+    self.pos = 0
+
+    # (controller, event) -> bound function, or None
+    self.targets = {}
+
+  def _target(self, controller, event):
+    key = (controller, event)
+    if key not in self.targets:
+      self.targets[key] = _bind(self.input_handler, controller, event)
+    return self.targets[key]
+
+  # Deliver everything recorded for this tick.
+  # Returns the number of events delivered.
+  def advance(self):
+    start = self.pos
+    events = self.events
+
+    while self.pos < len(events) and events[self.pos][0] <= self.tick:
+      _,controller,event,value = events[self.pos]
+      target = self._target(controller, event)
+      if target is not None:
+        target(value)
+      self.pos += 1
+
+    self.tick += 1
+    return self.pos - start
+
+  # True once every recorded event has been delivered
+  @property
+  def done(self):
+    return self.pos >= len(self.events)
+
+  # The tick of the last recorded event
+  @property
+  def last_tick(self):
+    if not self.events: return 0
+    return self.events[-1][0]
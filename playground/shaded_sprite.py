@@ -1,11 +1,20 @@
+from collections import OrderedDict
+import functools
+import hashlib
+import os
+import struct
+
+import numpy as np
 from PIL import Image
 import pyglet
 from pyglet.gl import *
 
+from texture_upload import image_data, StreamingTexture
+import asset_bundle
+
 # Return a pyglet image with just the plain color
 def _pil_to_pyglet(pil_image):
-  w,h = pil_image.size
-  return pyglet.image.ImageData(w, h, 'RGBA', pil_image.tobytes(), pitch=-4*w)
+  return image_data(pil_image)
 
 # Generate a single texture which is the sprite with
 # the correct background color.
@@ -13,6 +22,11 @@ def _pil_to_pyglet(pil_image):
 # bg_mask is the shape of the clothes (for example)
 # fg_sprite is anything to draw on top of the clothes
 def shaded_sprite(fg_sprite, bg_mask, bg_color):
+  return _pil_to_pyglet(shaded_image(fg_sprite, bg_mask, bg_color))
+
+# Same as shaded_sprite, but returns the PIL image.
+# For a single colour, PIL's composites beat the NumPy path.
+def shaded_image(fg_sprite, bg_mask, bg_color):
   sprite = Image.new('RGBA', fg_sprite.size)
 
   # A plain color sheet
@@ -23,16 +37,227 @@ def shaded_sprite(fg_sprite, bg_mask, bg_color):
 
   # Add the foreground on top of the sheet
   sprite = Image.alpha_composite(sprite, fg_sprite)
-  return _pil_to_pyglet(sprite)
+  return sprite
+
+# A whole palette of shaded sprites at once, as pyglet images
+def shaded_palette(fg_sprite, bg_mask, bg_colors):
+  pixels = recolor(fg_sprite, bg_mask, bg_colors)
+  if pixels is None:
+    return [ shaded_sprite(fg_sprite, bg_mask, c) for c in bg_colors ]
+  return [ image_data(p) for p in pixels ]
+
+
+# PIL's rounded division by 255
+def _div255(v):
+  return ((v >> 8) + v) >> 8
+
+# The mask as 0-255 coverage, the way Image.composite reads it
+def _mask_coverage(bg_mask):
+  if bg_mask.mode in ('RGBA', 'LA'):
+    return np.asarray(bg_mask.getchannel('A'))
+  if bg_mask.mode == 'L':
+    return np.asarray(bg_mask)
+  if bg_mask.mode == '1':
+    return np.asarray(bg_mask.convert('L'))
+  return None
+
+# BLEND_TABLE[c, m] is colour value c under coverage m, as PIL
+# rounds it when pasting through a mask
+BLEND_TABLE = _div255(np.arange(256, dtype=np.uint32)[:, None] *
+                      np.arange(256, dtype=np.uint32)[None, :] + 128).astype(np.uint8)
+
+# Vectorized shaded_image for any number of colours.
+# Returns a (colors, height, width, 4) uint8 array, with each entry
+# pixel-identical to what the PIL composites produce. Returns None
+# if the images are in modes this doesn't handle.
+#
+# Only pixels that actually depend on the colour get any arithmetic:
+# opaque foreground pixels are copied as they are, and the full
+# alpha-over math is done just for the partly transparent ones.
+def recolor(fg_sprite, bg_mask, bg_colors):
+  if fg_sprite.mode != 'RGBA' or bg_mask.size != fg_sprite.size: return None
+  coverage = _mask_coverage(bg_mask)
+  if coverage is None: return None
+
+  w,h = fg_sprite.size
+  colors = np.array([ tuple(c) + (255,) * (4 - len(c)) for c in bg_colors ],
+                    dtype=np.uint32).reshape(-1, 4)
+
+  fg = np.asarray(fg_sprite).reshape(-1, 4)
+  m = coverage.reshape(-1)
+  src_a = fg[:, 3]
+
+  # Opaque foreground wins outright, everything else starts transparent
+  template = np.where((src_a == 255)[:, None], fg, 0).astype(np.uint8)
+  out = np.repeat(template[None], len(colors), axis=0)
+
+  # Colour sheet cut to the mask, showing through the foreground
+  solid = np.flatnonzero((src_a == 0) & (m == 255))
+  out[:, solid] = colors[:, None, :]
+
+  edge = np.flatnonzero((src_a == 0) & (m > 0) & (m < 255))
+  out[:, edge] = BLEND_TABLE[colors[:, None, :], m[edge][None, :, None]]
+
+  # Foreground alpha-composited on top, same integer math as PIL
+  mixed = np.flatnonzero((src_a > 0) & (src_a < 255))
+  if mixed.size > 0:
+    bg = BLEND_TABLE[colors[:, None, :], m[mixed][None, :, None]]
+    fg_mixed = fg[mixed].astype(np.uint32)[None]
+
+    sa = fg_mixed[..., 3:4]
+    outa255 = sa * 255 + bg[..., 3:4] * (255 - sa)
+
+    precision = 7
+    coef1 = (sa * (255 * 255 << precision)) // outa255
+    coef2 = (255 << precision) - coef1
+
+    rgb = fg_mixed[..., :3] * coef1 + bg[..., :3] * coef2
+    out[:, mixed, :3] = _div255(rgb + (0x80 << precision)) >> precision
+    out[:, mixed, 3:4] = _div255(outa255 + 0x80)
+
+  return out.reshape(len(colors), h, w, 4)
+
+
+# Sprite files are decoded once and kept around, or taken straight
+# from a mounted asset bundle.
+# Callers must not modify the returned image.
+@functools.lru_cache(maxsize=None)
+def load_sprite(path):
+  image = asset_bundle.find_image(path)
+  if image is not None: return image
+
+  image = Image.open(path)
+  image.load()
+  return image
+
+
+# Shaded sprites built from files, by (fg path, mask path, color)
+#
+# The most recently used ones are kept in memory, so the same player
+# colour is only ever composited once. If disk_dir is set, the
+# composited RGBA pixels are also stored there and reused on the next
+# launch. Disk entries are named after the source files' size and
+# modification time, so editing a sprite invalidates them.
+class ShadedSpriteCache:
+  # Pixels are stored bottom row first, ready for GL
+  MAGIC = b"UWSF"
+  HEADER = struct.Struct("<4sII")
+
+  def __init__(self, capacity=64, disk_dir=None):
+    self.capacity = capacity
+    self.disk_dir = disk_dir
+    self.entries = OrderedDict()
+
+  def _disk_path(self, fg_path, mask_path, color):
+    ident = []
+    for path in (fg_path, mask_path):
+      st = os.stat(path)
+      ident += [ os.path.abspath(path), st.st_size, st.st_mtime_ns ]
+    ident += [ tuple(color) ]
+    digest = hashlib.sha1(repr(ident).encode("utf-8")).hexdigest()
+    return os.path.join(self.disk_dir, digest + ".rgba")
+
+  def _load_disk(self, path):
+    try:
+      with open(path, "rb") as f:
+        data = f.read()
+    except OSError:
+      return None
+
+    if len(data) < self.HEADER.size: return None
+    magic,w,h = self.HEADER.unpack_from(data)
+    if magic != self.MAGIC or len(data) != self.HEADER.size + 4*w*h: return None
+    return pyglet.image.ImageData(w, h, 'RGBA', data[self.HEADER.size:], pitch=4*w)
+
+  def _store_disk(self, path, pil_image):
+    w,h = pil_image.size
+
+    # Write and rename, so concurrent launches never see half a file
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    try:
+      os.makedirs(self.disk_dir, exist_ok=True)
+      with open(tmp, "wb") as f:
+        f.write(self.HEADER.pack(self.MAGIC, w, h))
+        f.write(pil_image.tobytes('raw', 'RGBA', 0, -1))
+      os.replace(tmp, path)
+    except OSError:
+      # Read-only or full, the sprite is just composited again next time
+      try:
+        os.remove(tmp)
+      except OSError:
+        pass
+
+  def get(self, fg_path, mask_path, color):
+    key = (fg_path, mask_path, tuple(color))
+    if key in self.entries:
+      self.entries.move_to_end(key)
+      return self.entries[key]
+
+    image = None
+    disk_path = None
+    if self.disk_dir is not None:
+      disk_path = self._disk_path(fg_path, mask_path, color)
+      image = self._load_disk(disk_path)
+
+    if image is None:
+      pil_image = shaded_image(load_sprite(fg_path), load_sprite(mask_path), tuple(color))
+      image = _pil_to_pyglet(pil_image)
+      if disk_path is not None:
+        self._store_disk(disk_path, pil_image)
+
+    self._remember(key, image)
+    return image
+
+  # get() for a list of colours, compositing the missing ones in one go
+  def get_many(self, fg_path, mask_path, colors):
+    missing = [ tuple(c) for c in colors
+                if (fg_path, mask_path, tuple(c)) not in self.entries ]
+
+    if missing and self.disk_dir is None:
+      images = shaded_palette(load_sprite(fg_path), load_sprite(mask_path), missing)
+      for color,image in zip(missing, images):
+        self._remember((fg_path, mask_path, color), image)
+
+    return [ self.get(fg_path, mask_path, c) for c in colors ]
+
+  def _remember(self, key, image):
+    self.entries[key] = image
+    if len(self.entries) > self.capacity:
+      self.entries.popitem(last=False)
+
+  def clear(self):
+    self.entries.clear()
+
+
+SPRITE_CACHE = ShadedSpriteCache()
 
 
 # Provide PIL image
 class ColoredSprite:
   def __init__(self, sprite_normal, mask_normal, color):
-    self.tex = shaded_sprite(sprite_normal, mask_normal, color)
+    self.sprite_normal = sprite_normal
+    self.mask_normal = mask_normal
+
+    # Own texture for recolouring, made on the first set_color()
+    self.stream = None
 
+    self._set_texture(shaded_sprite(sprite_normal, mask_normal, color))
+
+  def _set_texture(self, tex):
+    self.tex = tex
     self.width = self.tex.width
-    self.height = self.tex.width
+    self.height = self.tex.height
+
+  # Change colour in place. The first call gives the sprite a texture
+  # of its own (the original may be shared), later calls just
+  # overwrite its pixels.
+  def set_color(self, color):
+    pixels = shaded_image(self.sprite_normal, self.mask_normal, color)
+    if self.stream is None:
+      self.stream = StreamingTexture.from_source(pixels)
+      self._set_texture(self.stream.texture)
+    else:
+      self.stream.update(pixels)
 
   def draw(self, window, x, y):
     # Enable alpha, so transparent sprites work
@@ -41,12 +266,24 @@ class ColoredSprite:
     self.tex.blit(x, y)
 
 
+# If a SpriteAtlas is given, the texture is shared through it
+# (see sprite_atlas.add_cox_sprites)
 class ColoredCox(ColoredSprite):
-  def __init__(self, color):
-    sprite_normal = Image.open("sprites/player_fg_normal.png")
-    mask_normal = Image.open("sprites/player_bg_normal.png")
-    ColoredSprite.__init__(self,
-                           sprite_normal,
-                           mask_normal,
+  def __init__(self, color, atlas=None):
+    self.sprite_normal = load_sprite("sprites/player_fg_normal.png")
+    self.mask_normal = load_sprite("sprites/player_bg_normal.png")
+    self.stream = None
+
+    key = ("cox", tuple(color), "normal")
+    if atlas is not None and key in atlas:
+      self._set_texture(atlas[key])
+      return
+
+    tex = SPRITE_CACHE.get("sprites/player_fg_normal.png",
+                           "sprites/player_bg_normal.png",
                            color)
 
+    if atlas is not None:
+      tex = atlas.add(key, tex)
+    self._set_texture(tex)
+
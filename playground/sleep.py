@@ -0,0 +1,114 @@
+from spatial_hash import SpatialHash
+
+
+# Letting entities that aren't doing anything sleep
+#
+# Moving entities are added to a SleepSystem. Each tick, only the
+# ones from active() are ticked and collided, then settle() is
+# called:
+#
+#   for ent in sleep.active():
+#     ent.tick(dt)
+#     ...collide with the world...
+#   sleep.settle()
+#
+# An entity that is at rest (see Entity.at_rest) and hasn't changed
+# at all for ticks_to_sleep ticks is put to sleep. Its state then
+# stays exactly as it was, which is what ticking it would have done
+# anyway: with nothing moving and nothing pushing, a tick changes
+# nothing.
+#
+# It wakes up when
+#   * ent.wake() is called, which Player does when it gets input
+#     that would change anything (see Player.move and Player.jump)
+#   * a moving entity touches it
+#
+# The cost of a tick follows how many things are moving, not how
+# many there are.
+class SleepSystem:
+  def __init__(self, ticks_to_sleep=10, cell_size=64):
+    self.ticks_to_sleep = ticks_to_sleep
+
+    # The moving entities, for finding who touches whom
+    self.bodies = SpatialHash(cell_size)
+
+    # entity -> insertion order, for the awake ones
+    self.awake = {}
+
+    # entity -> (state last tick, ticks it's been the same)
+    self.still = {}
+
+    self.order = {}
+    self.counter = 0
+
+  def __len__(self):
+    return len(self.order)
+
+  def add(self, ent):
+    if ent in self.order: return
+    self.order[ent] = self.counter
+    self.counter += 1
+
+    self.bodies.insert(ent)
+    ent.on_wake = self._woken
+    ent.asleep = False
+    self.awake[ent] = self.order[ent]
+
+  def remove(self, ent):
+    if ent not in self.order: return
+    self.bodies.remove(ent)
+    self.awake.pop(ent, None)
+    self.still.pop(ent, None)
+    del self.order[ent]
+    ent.on_wake = None
+    ent.asleep = False
+
+  def _woken(self, ent):
+    self.awake[ent] = self.order[ent]
+    self.still.pop(ent, None)
+
+  # The entities to tick this time, in the order they were added
+  def active(self):
+    return sorted(self.awake, key=self.awake.get)
+
+  def sleeping(self):
+    return [ ent for ent in self.order if ent.asleep ]
+
+  def _state(self, ent):
+    return (ent.x, ent.y, ent.vx, ent.vy,
+            ent.bump_up, ent.bump_down, ent.bump_left, ent.bump_right)
+
+  # Touching counts, like in Entity.collide
+  def _touching(self, a, b):
+    return (a.x <= b.right and b.x <= a.right and
+            a.y <= b.top and b.y <= a.top)
+
+  # Call after the awake entities have been ticked and collided
+  def settle(self):
+    for ent in list(self.awake):
+      self.bodies.update(ent)
+
+      state = self._state(ent)
+      previous = self.still.get(ent)
+      changed = previous is not None and previous[0] != state
+
+      # Wake up anyone this one is touching, if it's moving. Two
+      # resting bodies side by side would otherwise keep each other
+      # awake forever.
+      if changed or not ent.at_rest():
+        for other in self.bodies.neighbours(ent):
+          if other.asleep and self._touching(ent, other):
+            other.wake()
+
+      if previous is None or changed or not ent.at_rest():
+        self.still[ent] = (state, 0)
+        continue
+
+      ticks = previous[1] + 1
+      if ticks < self.ticks_to_sleep:
+        self.still[ent] = (state, ticks)
+        continue
+
+      ent.asleep = True
+      del self.awake[ent]
+      del self.still[ent]
@@ -0,0 +1,220 @@
+import math
+
+
+# Broad-phase for Entity.collide
+#
+# A uniform grid of square cells, each holding the entities whose
+# bounding box overlaps it. Static entities are inserted once, moving
+# ones are re-binned with update() only when they change cells.
+#
+# collide() gives exactly the same result as running
+#   for ent in world: actor.collide(ent, snap)
+# over the entities in insertion order, but only tests the ones
+# sharing a cell with the actor.
+class SpatialHash:
+  def __init__(self, cell_size=64):
+    self.cell_size = cell_size
+
+    # (cx, cy) -> list of entities in that cell
+    self.cells = {}
+
+    # entity -> (insertion order, cell range)
+    self.entries = {}
+
+    self.counter = 0
+
+    # Entity pairs given to Entity.collide, see take_tested()
+    self.tested = 0
+
+  def __len__(self):
+    return len(self.entries)
+
+  def __contains__(self, ent):
+    return ent in self.entries
+
+  # Inclusive range of cells covered by a box.
+  # Touching edges count as overlap in collide(), so they count here too.
+  def _cell_range(self, x, y, right, top):
+    cs = self.cell_size
+    return (math.floor(x / cs), math.floor(y / cs),
+            math.floor(right / cs), math.floor(top / cs))
+
+  def _bin(self, ent, cells):
+    x0, y0, x1, y1 = cells
+    for cx in range(x0, x1+1):
+      for cy in range(y0, y1+1):
+        key = (cx, cy)
+        if key in self.cells:
+          self.cells[key].append(ent)
+        else:
+          self.cells[key] = [ ent ]
+
+  def _unbin(self, ent, cells):
+    x0, y0, x1, y1 = cells
+    for cx in range(x0, x1+1):
+      for cy in range(y0, y1+1):
+        key = (cx, cy)
+        bucket = self.cells[key]
+        bucket.remove(ent)
+        if not bucket:
+          del self.cells[key]
+
+  def insert(self, ent):
+    if ent in self.entries: return
+    cells = self._cell_range(ent.x, ent.y, ent.right, ent.top)
+    self.entries[ent] = (self.counter, cells)
+    self.counter += 1
+    self._bin(ent, cells)
+
+  def remove(self, ent):
+    if ent not in self.entries: return
+    _,cells = self.entries.pop(ent)
+    self._unbin(ent, cells)
+
+  # Call after moving an entity. Cheap if it stays in the same cells.
+  def update(self, ent):
+    order,cells = self.entries[ent]
+    new_cells = self._cell_range(ent.x, ent.y, ent.right, ent.top)
+    if new_cells == cells: return
+
+    self._unbin(ent, cells)
+    self._bin(ent, new_cells)
+    self.entries[ent] = (order, new_cells)
+
+  def _gather(self, cells, found):
+    x0, y0, x1, y1 = cells
+    for cx in range(x0, x1+1):
+      for cy in range(y0, y1+1):
+        bucket = self.cells.get((cx, cy))
+        if bucket is None: continue
+        for ent in bucket:
+          found.add(ent)
+
+  def _order(self, ent):
+    return self.entries[ent][0]
+
+  # All entities whose cells overlap the box, in insertion order
+  def query(self, x, y, right, top):
+    found = set()
+    self._gather(self._cell_range(x, y, right, top), found)
+    return sorted(found, key=self._order)
+
+  # Candidates for collision with the given entity, itself excluded
+  def neighbours(self, actor):
+    found = self.query(actor.x, actor.y, actor.right, actor.top)
+    return [ ent for ent in found if ent is not actor ]
+
+  # Move the actor by (dx, dy), stopping where it would first hit
+  # something instead of passing through it. See sweep_move().
+  def sweep(self, actor, dx, dy):
+    return sweep_move(self, actor, dx, dy)
+
+  # Number of pairs collide() has tested since the last call
+  def take_tested(self):
+    tested = self.tested
+    self.tested = 0
+    return tested
+
+  # Collide the actor against everything it may touch.
+  # Candidates are visited in insertion order, like a plain list of
+  # the world would be. If a snap pushes the actor into new cells,
+  # the entities found there are merged into the remaining candidates
+  # so the outcome stays identical to the brute-force loop.
+  # Returns True if there is any collision.
+  def collide(self, actor, snap=False):
+    cells = self._cell_range(actor.x, actor.y, actor.right, actor.top)
+    seen = set()
+    self._gather(cells, seen)
+    seen.discard(actor)
+    pending = sorted(seen, key=self._order)
+    self.tested += len(pending)
+
+    collision = False
+    i = 0
+    while i < len(pending):
+      ent = pending[i]
+      i += 1
+
+      if not actor.collide(ent, snap): continue
+      collision = True
+      if not snap: continue
+
+      moved = self._cell_range(actor.x, actor.y, actor.right, actor.top)
+      if moved == cells: continue
+      cells = moved
+
+      # Only entities later in the order than the current one
+      # would have been tested after it.
+      current = self._order(ent)
+      found = set()
+      self._gather(cells, found)
+      extra = [ e for e in found
+                if e not in seen and e is not actor and self._order(e) > current ]
+      if extra:
+        self.tested += len(extra)
+        seen.update(extra)
+        pending = sorted(pending[i:] + extra, key=self._order)
+        i = 0
+
+    return collision
+
+
+# Move the actor by (dx, dy), stopping where it would first hit
+# something instead of passing through it. index is anything with
+# query(x, y, right, top) returning entities in insertion order,
+# like a SpatialHash.
+#
+# At a hit the actor is put right against the surface, and the
+# rest of the move continues along it (sliding along a floor, say).
+# Bumps aren't set here. Follow up with collide() as usual, which
+# sees the actor touching whatever stopped it.
+# Returns True if anything was hit.
+def sweep_move(index, actor, dx, dy):
+  hit_any = False
+
+  # After two hits, one per axis, there's nothing left to move
+  for _ in range(2):
+    if dx == 0 and dy == 0: break
+
+    # Everything the whole move passes over
+    candidates = index.query(min(actor.x, actor.x + dx),
+                             min(actor.y, actor.y + dy),
+                             max(actor.right, actor.right + dx),
+                             max(actor.top, actor.top + dy))
+
+    best = None
+    for ent in candidates:
+      if ent is actor: continue
+      hit = actor.sweep(ent, dx, dy)
+      if hit is None: continue
+      # Ties go to the earliest inserted, like in collide()
+      if best is None or hit[0] < best[0]:
+        best = (hit[0], hit[1], ent)
+
+    if best is None:
+      actor.x += dx
+      actor.y += dy
+      dx = dy = 0
+      break
+
+    t,vertical,ent = best
+    hit_any = True
+
+    if vertical:
+      actor.x += dx * t
+      if dy > 0:
+        actor.y = ent.y - actor.height
+      else:
+        actor.y = ent.top
+      dx = dx * (1 - t)
+      dy = 0
+    else:
+      actor.y += dy * t
+      if dx > 0:
+        actor.x = ent.x - actor.width
+      else:
+        actor.x = ent.right
+      dx = 0
+      dy = dy * (1 - t)
+
+  return hit_any
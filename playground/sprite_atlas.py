@@ -0,0 +1,87 @@
+import os
+
+import pyglet
+
+from shaded_sprite import SPRITE_CACHE
+import asset_bundle
+
+
+# All the sprites of a game packed into as few textures as possible
+#
+# Images are added under a key and come back as texture regions,
+# which can be drawn like any other pyglet image. Sprites sharing an
+# atlas texture are drawn with a single texture bind, and a
+# RenderLayer can draw them all in one go.
+class SpriteAtlas:
+  def __init__(self, size=1024):
+    self.bin = pyglet.image.atlas.TextureBin(size, size)
+
+    # key -> texture region
+    self.regions = {}
+
+  def __contains__(self, key):
+    return key in self.regions
+
+  def __getitem__(self, key):
+    return self.regions[key]
+
+  # Add a pyglet image, unless the key is already there
+  def add(self, key, image):
+    if key in self.regions: return self.regions[key]
+
+    # A pixel of border so neighbours don't bleed in when filtering
+    region = self.bin.add(image, border=1)
+    self.regions[key] = region
+    return region
+
+  # From a mounted asset bundle if it's there, else the file itself
+  def add_file(self, key, path):
+    if key in self.regions: return self.regions[key]
+    image = asset_bundle.find_image_data(path)
+    if image is None:
+      image = pyglet.image.load(path)
+    return self.add(key, image)
+
+  # The textures that actually get bound
+  def textures(self):
+    return [ atlas.texture for atlas in self.bin.atlases ]
+
+
+# Player states that have a sprite and a clothes mask to colour
+def cox_states(sprite_dir="sprites"):
+  states = []
+  for name in sorted(os.listdir(sprite_dir)):
+    if not (name.startswith("player_fg_") and name.endswith(".png")): continue
+    state = name[len("player_fg_"):-len(".png")]
+    if os.path.exists(os.path.join(sprite_dir, "player_bg_{}.png".format(state))):
+      states += [ state ]
+  return states
+
+
+# Shaded player sprites for every colour and state.
+# They end up under the key ("cox", color, state)
+def add_cox_sprites(atlas, colors, states=None, sprite_dir="sprites"):
+  if states is None: states = cox_states(sprite_dir)
+
+  for state in states:
+    fg_path = os.path.join(sprite_dir, "player_fg_{}.png".format(state))
+    mask_path = os.path.join(sprite_dir, "player_bg_{}.png".format(state))
+
+    missing = [ tuple(c) for c in colors if ("cox", tuple(c), state) not in atlas ]
+    images = SPRITE_CACHE.get_many(fg_path, mask_path, missing)
+    for color,image in zip(missing, images):
+      atlas.add(("cox", color, state), image)
+
+
+# Everything the playground games use, in one atlas.
+#   ("cox", color, state) for the coloured players
+#   "player_normal", "player_ouch", "banana" for the plain sprites
+def build_game_atlas(colors, sprite_dir="sprites", size=1024):
+  atlas = SpriteAtlas(size)
+
+  add_cox_sprites(atlas, colors, sprite_dir=sprite_dir)
+
+  for name in [ "player_normal", "player_ouch", "banana" ]:
+    atlas.add_file(name, os.path.join(sprite_dir, name + ".png"))
+
+  return atlas
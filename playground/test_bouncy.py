@@ -4,15 +4,20 @@ import pyglet
 from pyglet.gl import *
 import random
 
+from render_batch import RenderLayer
+from sprite_atlas import SpriteAtlas
+import asset_bundle
+
 def clamp(a, lower, upper):
   if (a > upper): return upper
   if (a < lower): return lower
   return a
 
 class Cox:
-  def __init__(self, x=20, y=20):
-    self.sprite_normal = pyglet.resource.image("sprites/player_normal.png")
-    self.sprite_ouch = pyglet.resource.image("sprites/player_ouch.png")
+  def __init__(self, atlas, x=20, y=20):
+    # Shared by all the coxes, from one texture
+    self.sprite_normal = atlas.add_file("player_normal", "sprites/player_normal.png")
+    self.sprite_ouch = atlas.add_file("player_ouch", "sprites/player_ouch.png")
 
     self.x = x
     self.y = y
@@ -25,15 +30,11 @@ class Cox:
     self.ouch_ticks = 20
     self.ticks_since_bounce = 0
 
-  def draw(self, window):
+  def image(self):
     sprite = self.sprite_normal
     if self.ticks_since_bounce <= self.ouch_ticks:
       sprite = self.sprite_ouch
-
-    # Enable alpha, so transparent sprites work
-    glEnable(GL_BLEND)
-    glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
-    sprite.blit(self.x, self.y)
+    return sprite
 
 
   def tick(self, window, dt):
@@ -61,20 +62,31 @@ class Cox:
 
 window = pyglet.window.Window()
 
+# Pre-decoded sprites, if ./asset_bundle.py build assets.bundle was run
+asset_bundle.mount("assets.bundle", missing_ok=True)
+
+atlas = SpriteAtlas()
+
 n_coxes = 40
 coxes = []
 for c in range(n_coxes):
-  coxes += [Cox(
+  coxes += [Cox(atlas,
                x=random.randrange(32, window.height-32),
                y=random.randrange(32, window.height-32)
               )]
 
+layer = RenderLayer()
+for p in coxes:
+  layer.add_sprite(p, p.image())
+
 @window.event
 def on_draw():
   window.clear()
 
   for p in coxes:
-    p.draw(window)
+    layer.set_image(p, p.image())
+  layer.update()
+  layer.draw()
 
 
 def tick(dt):
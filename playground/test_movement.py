@@ -9,6 +9,7 @@ from threading import Lock
 # Our own little support library
 from platforming import Player, PlayerController
 from shaded_sprite import ColoredCox
+from fixed_step import FixedStepLoop
 
 from pyglet.gl import *
 
@@ -26,10 +27,14 @@ player1.y = 20
 @window.event
 def on_draw():
   window.clear()
-  player1.draw(window)
+  # Drawn between the last two physics steps
+  player1.sprite.draw(window, *loop.position(player1))
 
 
 def tick(dt):
+  # Input is applied here, never in the middle of a tick
+  input_queue.drain()
+
   player1.tick(dt)
 
   collide_world(player1)
@@ -59,14 +64,17 @@ def collide_world(actor):
 
 
 controller = PlayerController(player1)
+input_queue = input_mapper.InputQueue(controller)
 controls = json.loads(open("../game_config.json").read())
-input_mapper.setup(controller, controls)
+input_mapper.setup(input_queue, controls)
 
 input_mapper.start()
 
 
-# 60FPS animations
-pyglet.clock.schedule_interval(tick, 1/60)
+# 60Hz physics, drawn as often as the display allows
+loop = FixedStepLoop(tick, 60)
+loop.track(player1)
+pyglet.clock.schedule(loop.frame)
 
 pyglet.app.run()
 
@@ -4,13 +4,21 @@ from PIL import Image
 import pyglet
 import json
 import math
+import os
+import sys
 
 from threading import Lock
 
 # Our own little support library
 from platforming import Player,PlayerController
 from shaded_sprite import ColoredCox
-from physics import ColoredBlock
+from tilemap import TileMap
+from fixed_step import FixedStepLoop
+from render_batch import RenderLayer
+from sprite_atlas import build_game_atlas
+from replay import InputRecorder, InputReplayer
+from profiler import Profiler, ProfilerOverlay
+import asset_bundle
 
 from pyglet.gl import *
 
@@ -18,62 +26,106 @@ import input_mapper
 
 
 def tick(dt):
-  player1.tick(dt)
-
-  collide_world(player1, world)
+  # Input is applied here, never in the middle of a tick
+  if replayer is not None:
+    replayer.advance()
+  else:
+    input_queue.drain()
+    if recorder is not None:
+      recorder.advance()
 
-def make_world(window):
-  world = [ ]
-  # Border
-  world += [ ColoredBlock(-32, -32, window.width+64, 40, None, "Floor") ]
-  world += [ ColoredBlock(-32, -32, 40, window.height+64, None, "LeftWall") ]
-  world += [ ColoredBlock(window.width-8, -32, 48, window.height+64, None, "RightWall") ]
-  world += [ ColoredBlock(-32, window.height-8, window.width+64, 40, None, "Ceiling") ]
-
-  # Some boxes to jump and bump
-  world += [ ColoredBlock(100, 96, 300, 32, None, "box1") ]
+  player1.tick(dt)
 
-  return world
+  with profiler.scope("collide"):
+    collide_world(player1, world_hash)
 
-def collide_world(actor, world):
+def collide_world(actor, world_hash):
   actor.bump_up = False
   actor.bump_down = False
   actor.bump_left = False
   actor.bump_right = False
 
-  for ent in world:
-    actor.collide(ent, True)
+  world_hash.collide(actor, True)
 
 
 window = pyglet.window.Window()
 
 @window.event
 def on_draw():
-  window.clear()
-  for ent in world:
-    ent.draw(window)
-  player1.draw(window)
+  with profiler.scope("draw"):
+    window.clear()
+    # Player drawn between the last two physics steps
+    layer.update(loop.position)
+    layer.draw()
+
+    if overlay is not None:
+      overlay.draw()
+
+  profiler.end_frame()
+
 
+# UWARE_PROFILE=trace.json shows frame stats on screen,
+# and saves a Chrome trace on exit
+trace_path = os.environ.get("UWARE_PROFILE")
+profiler = Profiler(enabled=bool(trace_path))
+overlay = None
+if profiler.enabled:
+  overlay = ProfilerOverlay(profiler, window)
 
-p1_sprite = ColoredCox((0xce, 0x39, 0x10, 255))
+
+# Pre-decoded sprites, if ./asset_bundle.py build assets.bundle was run
+asset_bundle.mount("assets.bundle", missing_ok=True)
+
+p1_color = (0xce, 0x39, 0x10, 255)
+atlas = build_game_atlas([ p1_color ])
+
+p1_sprite = ColoredCox(p1_color, atlas)
 player1 = Player(p1_sprite)
 
-player1.x = 20
+# Just right of the left wall, same as in headless.py
+player1.x = 32
 player1.y = 300
 
-world = make_world(window)
+# The level is static, indexed by its tiles and drawn as one vertex list
+world_hash = TileMap.load("levels/playground.json")
+
+layer = RenderLayer()
+layer.add_tilemap(world_hash)
+layer.add_sprite(player1, p1_sprite.tex)
+profiler.sample("pairs", world_hash.take_tested)
 
 controller = PlayerController(player1)
-controls = json.loads(open("../game_config.json").read())
-input_mapper.setup(controller, controls)
 
-input_mapper.start()
+# --record FILE saves the input, --replay FILE plays it back
+recorder = None
+replayer = None
+if (len(sys.argv) == 3 and sys.argv[1] == "--replay"):
+  replayer = InputReplayer(controller, sys.argv[2])
+else:
+  handler = controller
+  if (len(sys.argv) == 3 and sys.argv[1] == "--record"):
+    recorder = InputRecorder(controller, sys.argv[2])
+    handler = recorder
+
+  input_queue = input_mapper.InputQueue(handler)
+  controls = json.loads(open("../game_config.json").read())
+  input_mapper.setup(input_queue, controls, profiler)
+  profiler.sample("queue", lambda: len(input_queue))
+
+  input_mapper.start()
 
 
-# 60FPS animations
-pyglet.clock.schedule_interval(tick, 1/60)
+# 60Hz physics, drawn as often as the display allows
+loop = FixedStepLoop(profiler.wrap("tick", tick), 60)
+loop.track(player1)
+pyglet.clock.schedule(loop.frame)
 
 pyglet.app.run()
 
-input_mapper.stop()
-input_mapper.shutdown()
+if replayer is None:
+  input_mapper.stop()
+  input_mapper.shutdown()
+if recorder is not None:
+  recorder.close()
+if profiler.enabled:
+  profiler.export_chrome_trace(trace_path)
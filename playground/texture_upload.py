@@ -0,0 +1,88 @@
+import ctypes
+
+import numpy as np
+import pyglet
+from pyglet.gl import *
+
+
+# Getting pixels into GL without the extra copies
+#
+# GL wants the bottom row first, PIL and NumPy keep the top row
+# first. Instead of handing pyglet a negative pitch (which makes it
+# reverse the rows in Python on every upload), the rows are flipped
+# once while the pixels are extracted, and the result is passed to
+# GL as it is.
+#
+# Sources can be a PIL image, or an (height, width, 4) uint8 array
+# in the usual top-row-first order.
+
+
+def _size(source):
+  if isinstance(source, np.ndarray):
+    h,w = source.shape[:2]
+    return w, h
+  return source.size
+
+# Returns (width, height, pixels) with pixels bottom row first,
+# in something ctypes can pass as a pointer
+def _bottom_up(source):
+  w,h = _size(source)
+  if isinstance(source, np.ndarray):
+    # Flipping costs one copy of the image, handing that copy to
+    # ctypes doesn't cost another
+    flipped = np.ascontiguousarray(source[::-1], dtype=np.uint8)
+    return w, h, (ctypes.c_ubyte * flipped.nbytes).from_buffer(flipped)
+
+  # The raw encoder can write the rows in reverse order directly
+  if source.mode != 'RGBA':
+    source = source.convert('RGBA')
+  return w, h, source.tobytes('raw', 'RGBA', 0, -1)
+
+
+# A pyglet image that uploads without any conversion
+def image_data(source):
+  w,h,pixels = _bottom_up(source)
+  return pyglet.image.ImageData(w, h, 'RGBA', pixels, pitch=4*w)
+
+
+# Overwrite a texture (or a region of one, e.g. in an atlas) with new
+# pixels of the same size. Nothing new is allocated on the GPU.
+# Raises ValueError if the pixels don't fit, rather than spilling
+# over into whatever is next to the region.
+def upload(texture, source, x=0, y=0):
+  w,h = _size(source)
+  if (x < 0 or y < 0 or x + w > texture.width or y + h > texture.height):
+    raise ValueError("{}x{} pixels at ({}, {}) don't fit in a {}x{} texture".format(
+                     w, h, x, y, texture.width, texture.height))
+
+  w,h,pixels = _bottom_up(source)
+
+  # Rows are packed tight, put the alignment back for everyone else
+  alignment = GLint()
+  glGetIntegerv(GL_UNPACK_ALIGNMENT, ctypes.byref(alignment))
+
+  glBindTexture(texture.target, texture.id)
+  glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+  glTexSubImage2D(texture.target, texture.level,
+                  texture.x + x, texture.y + y, w, h,
+                  GL_RGBA, GL_UNSIGNED_BYTE, pixels)
+  glPixelStorei(GL_UNPACK_ALIGNMENT, alignment.value)
+
+
+# A texture of its own that gets new contents now and then, like a
+# sprite being recoloured or reloaded from disk
+class StreamingTexture:
+  def __init__(self, width, height):
+    self.texture = pyglet.image.Texture.create(width, height, GL_RGBA)
+    self.width = width
+    self.height = height
+
+  @staticmethod
+  def from_source(source):
+    w,h = _size(source)
+    tex = StreamingTexture(w, h)
+    tex.update(source)
+    return tex
+
+  def update(self, source):
+    upload(self.texture, source)
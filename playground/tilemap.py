@@ -0,0 +1,283 @@
+import json
+import math
+import struct
+
+import numpy as np
+
+from physics import ColoredBlock
+from spatial_hash import sweep_move
+import asset_bundle
+
+
+# A level made of square tiles, each either solid or empty
+#
+# Two file formats:
+#
+#   JSON, for writing levels by hand. Rows are listed top first, and
+#   any character but "." or " " is solid:
+#     { "tile_size": 32,
+#       "rows": [ "##########",
+#                 "#........#",
+#                 "##########" ] }
+#
+#   Binary, for big levels:
+#     "UWTM", u16 version, u32 width, u32 height, u16 tile size,
+#     then width*height bytes, bottom row first, non-zero is solid.
+#
+# Tile (0, 0) is the bottom left one, with its corner at (0, 0) in
+# the world, like everything else y goes up.
+#
+# On load, solid tiles are merged into as few rectangles as the
+# greedy meshing here finds: runs of solid tiles along each row,
+# then identical runs in consecutive rows stacked together. Those
+# rectangles are what entities collide with and what gets drawn,
+# all kept in arrays. An Entity (a ColoredBlock) is only made for a
+# rectangle when something actually touches it.
+#
+# TileMap has the same collide() and sweep() as a SpatialHash, and
+# can be used in place of one for the static world.
+
+MAGIC = b"UWTM"
+VERSION = 1
+HEADER = struct.Struct("<4sHIIH")
+
+
+# Returns an array of (row, x0, x1) for every run of solid tiles,
+# x1 exclusive, sorted by row and then x0
+def _runs(solid):
+  h,w = solid.shape
+  padded = np.zeros((h, w + 2), dtype=np.int8)
+  padded[:, 1:-1] = solid
+  edges = np.diff(padded, axis=1)
+
+  rows,starts = np.nonzero(edges == 1)
+  _,ends = np.nonzero(edges == -1)
+  return rows, starts, ends
+
+# Greedy meshing. Returns the rectangles as arrays (x, y, w, h) in
+# tiles, and for each run which rectangle it went into.
+def _merge(rows, starts, ends):
+  n = len(rows)
+  if n == 0:
+    empty = np.zeros(0, dtype=np.int64)
+    return (empty, empty, empty, empty), empty
+
+  # Group identical spans, in row order within each group
+  order = np.lexsort((rows, ends, starts))
+  r = rows[order]
+  s = starts[order]
+  e = ends[order]
+
+  # A new rectangle starts wherever the span changes, or a row is skipped
+  new = np.ones(n, dtype=np.bool_)
+  new[1:] = (s[1:] != s[:-1]) | (e[1:] != e[:-1]) | (r[1:] != r[:-1] + 1)
+  first = np.flatnonzero(new)
+  group = np.cumsum(new) - 1
+
+  count = np.diff(np.append(first, n))
+  rect_x = s[first]
+  rect_y = r[first]
+  rect_w = e[first] - s[first]
+  rect_h = count
+
+  # Number the rectangles bottom to top, left to right
+  by_position = np.lexsort((rect_x, rect_y))
+  renumber = np.empty_like(by_position)
+  renumber[by_position] = np.arange(len(by_position))
+
+  run_rect = np.empty(n, dtype=np.int64)
+  run_rect[order] = renumber[group]
+
+  rects = (rect_x[by_position], rect_y[by_position],
+           rect_w[by_position], rect_h[by_position])
+  return rects, run_rect
+
+
+class TileMap:
+  # solid is a (height, width) array, bottom row first
+  def __init__(self, solid, tile_size=32):
+    self.solid = np.ascontiguousarray(solid, dtype=np.bool_)
+    self.height, self.width = self.solid.shape
+    self.tile_size = tile_size
+
+    rows,starts,ends = _runs(self.solid)
+    (rx, ry, rw, rh),run_rect = _merge(rows, starts, ends)
+
+    ts = tile_size
+    self.rect_x = rx * ts
+    self.rect_y = ry * ts
+    self.rect_w = rw * ts
+    self.rect_h = rh * ts
+
+    # Which rectangle each tile belongs to, -1 for empty tiles
+    self.rect_id = np.full(self.solid.shape, -1, dtype=np.int32)
+    lengths = ends - starts
+    if len(lengths):
+      # Index of every solid tile, run by run
+      first = np.repeat(rows * self.width + starts, lengths)
+      within = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+      self.rect_id.reshape(-1)[first + within] = np.repeat(run_rect, lengths)
+
+    # Made when first needed
+    self.blocks = [ None ] * len(self.rect_x)
+
+    # Rectangles given to Entity.collide, see take_tested()
+    self.tested = 0
+
+  # From a mounted asset bundle if it's there, else the file itself
+  @staticmethod
+  def load(path):
+    found = asset_bundle.find_tiles(path)
+    if found is not None:
+      tiles,tile_size = found
+      return TileMap(tiles != 0, tile_size)
+
+    with open(path, "rb") as f:
+      data = f.read()
+    if data[:len(MAGIC)] == MAGIC:
+      return TileMap.from_bytes(data)
+    return TileMap.from_json(json.loads(data.decode("utf-8")))
+
+  @staticmethod
+  def from_json(level):
+    rows = level["rows"]
+    width = max([ len(row) for row in rows ] + [ 0 ])
+    text = "".join(row.ljust(width, ".") for row in rows).encode("utf-8")
+    chars = np.frombuffer(text, dtype=np.uint8).reshape(len(rows), width)
+    solid = (chars != ord(".")) & (chars != ord(" "))
+    return TileMap(solid[::-1], level.get("tile_size", 32))
+
+  @staticmethod
+  def from_bytes(data):
+    magic,version,width,height,tile_size = HEADER.unpack_from(data)
+    if magic != MAGIC:
+      raise ValueError("Not a tile map")
+    if version != VERSION:
+      raise ValueError("Unsupported tile map version {}".format(version))
+    if len(data) != HEADER.size + width * height:
+      raise ValueError("Tile map is {} bytes, expected {}".format(len(data), HEADER.size + width * height))
+
+    tiles = np.frombuffer(data, dtype=np.uint8, count=width * height, offset=HEADER.size)
+    return TileMap(tiles.reshape(height, width) != 0, tile_size)
+
+  def to_bytes(self):
+    return (HEADER.pack(MAGIC, VERSION, self.width, self.height, self.tile_size)
+            + self.solid.astype(np.uint8).tobytes())
+
+  def save(self, path):
+    with open(path, "wb") as f:
+      f.write(self.to_bytes())
+
+  def __len__(self):
+    return len(self.rect_x)
+
+  #
+  # Solidity by grid position
+  #
+
+  def solid_at(self, tx, ty):
+    if tx < 0 or ty < 0 or tx >= self.width or ty >= self.height: return False
+    return bool(self.solid[ty, tx])
+
+  # The tile under a point in the world
+  def solid_at_point(self, x, y):
+    return self.solid_at(math.floor(x / self.tile_size), math.floor(y / self.tile_size))
+
+  # Inclusive tile range touching a box, edges included, clipped to
+  # the map. None if it's entirely outside.
+  def _tile_range(self, x, y, right, top):
+    ts = self.tile_size
+    tx0 = max(0, math.ceil(x / ts) - 1)
+    ty0 = max(0, math.ceil(y / ts) - 1)
+    tx1 = min(self.width - 1, math.floor(right / ts))
+    ty1 = min(self.height - 1, math.floor(top / ts))
+    if tx0 > tx1 or ty0 > ty1: return None
+    return tx0, ty0, tx1, ty1
+
+  # True if any solid tile overlaps or touches the box
+  def solid_in(self, x, y, right, top):
+    tiles = self._tile_range(x, y, right, top)
+    if tiles is None: return False
+    tx0,ty0,tx1,ty1 = tiles
+    return bool(self.solid[ty0:ty1+1, tx0:tx1+1].any())
+
+  #
+  # Collision, like a SpatialHash of the merged rectangles
+  #
+
+  def block(self, i):
+    block = self.blocks[i]
+    if block is None:
+      block = ColoredBlock(float(self.rect_x[i]), float(self.rect_y[i]),
+                           float(self.rect_w[i]), float(self.rect_h[i]),
+                           None, "tiles{}".format(i))
+      self.blocks[i] = block
+    return block
+
+  def _rect_ids(self, tiles):
+    if tiles is None: return set()
+    tx0,ty0,tx1,ty1 = tiles
+    ids = set(self.rect_id[ty0:ty1+1, tx0:tx1+1].ravel().tolist())
+    ids.discard(-1)
+    return ids
+
+  # Rectangles touching the box, in order
+  def query(self, x, y, right, top):
+    ids = self._rect_ids(self._tile_range(x, y, right, top))
+    return [ self.block(i) for i in sorted(ids) ]
+
+  def neighbours(self, actor):
+    return self.query(actor.x, actor.y, actor.right, actor.top)
+
+  # Same as SpatialHash.collide: identical to colliding with every
+  # rectangle in order, but only testing the ones nearby.
+  def collide(self, actor, snap=False):
+    tiles = self._tile_range(actor.x, actor.y, actor.right, actor.top)
+    seen = self._rect_ids(tiles)
+    pending = sorted(seen)
+    self.tested += len(pending)
+
+    collision = False
+    i = 0
+    while i < len(pending):
+      current = pending[i]
+      i += 1
+
+      if not actor.collide(self.block(current), snap): continue
+      collision = True
+      if not snap: continue
+
+      moved = self._tile_range(actor.x, actor.y, actor.right, actor.top)
+      if moved == tiles: continue
+      tiles = moved
+
+      extra = [ r for r in self._rect_ids(tiles) if r not in seen and r > current ]
+      if extra:
+        seen.update(extra)
+        self.tested += len(extra)
+        pending = sorted(pending[i:] + extra)
+        i = 0
+
+    return collision
+
+  def sweep(self, actor, dx, dy):
+    return sweep_move(self, actor, dx, dy)
+
+  # Number of rectangles collide() has tested since the last call
+  def take_tested(self):
+    tested = self.tested
+    self.tested = 0
+    return tested
+
+  #
+  # Drawing
+  #
+
+  # All the rectangles as one flat array of quad corners,
+  # (x, y) * 4 per rectangle, ready for a static vertex buffer
+  def vertices(self):
+    x0 = self.rect_x.astype(np.float32)
+    y0 = self.rect_y.astype(np.float32)
+    x1 = x0 + self.rect_w
+    y1 = y0 + self.rect_h
+    return np.stack([ x0, y0, x1, y0, x1, y1, x0, y1 ], axis=1).reshape(-1)